@@ -0,0 +1,61 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from stations import modal_coordinates
+
+# Benchmark of stations.modal_coordinates against the per-group mode() lambda it replaces
+# (master_coords in loading_merging_data.ipynb, station_coords_clean in making_station_summary.ipynb)
+
+
+def synthetic_coords(rows, stations=1700, seed=1):
+    # One row per trip end, like the raw data: classic bikes report one of a few fixed coordinate
+    # versions per station, electric bikes report their own GPS position (5 decimals) around it
+    rng = np.random.default_rng(seed)
+    station = rng.integers(0, stations, rows)
+    base_lat = rng.uniform(40.6, 40.9, stations)
+    base_lng = rng.uniform(-74.05, -73.85, stations)
+    electric = rng.random(rows) < 0.4
+    lat = base_lat[station] + np.where(electric, rng.integers(-50, 50, rows), rng.integers(0, 3, rows)) * 1e-5
+    lng = base_lng[station] + np.where(electric, rng.integers(-50, 50, rows), rng.integers(0, 3, rows)) * 1e-5
+    return pd.DataFrame({
+        'station_id': pd.Categorical.from_codes(station, sorted(f"{i}.{i % 100:02d}" for i in range(stations))),
+        'lat': lat.astype('float32'),
+        'lng': lng.astype('float32'),
+    })
+
+
+def lambda_mode(coords_df):
+    return (
+        coords_df.groupby('station_id', observed=True)[['lat', 'lng']]
+        .agg(lambda x: x.mode().iloc[0] if not x.mode().empty else x.iloc[0])
+        .reset_index()
+    )
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare modal_coordinates with the groupby/mode() lambda")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--stations", type=int, default=1700)
+    args = parser.parse_args()
+
+    coords_df = synthetic_coords(args.rows, args.stations)
+    print(f"{len(coords_df):,} rows, {args.stations:,} stations")
+
+    expected, t_lambda = timed(lambda_mode, coords_df)
+    print(f"lambda mode():     {t_lambda:8.2f} s")
+
+    result, t_vector = timed(modal_coordinates, coords_df)
+    print(f"modal_coordinates: {t_vector:8.2f} s  ({t_lambda / t_vector:.1f}x faster)")
+
+    expected['station_id'] = expected['station_id'].astype(object)
+    pd.testing.assert_frame_equal(expected, result, check_dtype=False)
+    print("Results identical")
@@ -0,0 +1,202 @@
+import argparse
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from duration_stats import DURATION_HISTOGRAM_QUERY, box_stats
+from rollups import create_weather_view
+from sampling import SAMPLE_SIZE, STRATA, StratifiedSampler
+
+# Builds every file the dashboard needs (top_20.csv, routes.csv, df_weather.csv, df_sample_100.csv,
+# duration_box.csv)
+# from one read of the trip data, instead of one DuckDB query over the full file per output as in
+# chart_data_queries.ipynb.
+# The trips are streamed batch by batch. Each batch is aggregated by DuckDB into the few small tables the
+# outputs are read from - trips per day, per route (with coordinates) and per duration second, the sketch
+# behind the box plot statistics (duration_stats.py) - and added into running totals, so what is kept
+# between batches is never bigger than the number of routes. Every batch also goes through the stratified
+# sampler (sampling.py) for df_sample_100.csv.
+# The trips carry no weather; df_weather.csv joins the daily weather table (wide_weather.csv) to the daily counts.
+
+bigfile = Path('C:/Data/Citibike_NY_2022/merged/df_weather_duration.parquet')
+output_dir = Path('C:/Data/Citibike_NY_2022/merged')
+weather_file = Path('C:/Data/Citibike_NY_2022/wide_weather.csv')
+
+BATCH_SIZE = 2_000_000
+
+# table -> (aggregate of a batch, merge of partial aggregates in {parts})
+# any coordinates of a route will do: the cleaned trip file (loading_merging_data.ipynb) has one pair per station
+TOTALS = {
+    'daily': (
+        "SELECT CAST(date AS DATE) AS date, COUNT(*) AS num_trips FROM batch GROUP BY ALL",
+        "SELECT date, SUM(num_trips)::BIGINT AS num_trips FROM {parts} GROUP BY ALL",
+    ),
+    'route_totals': (
+        """
+        SELECT
+            start_station_name,
+            end_station_name,
+            COUNT(*) AS num_trips,
+            ANY_VALUE(start_lat) AS start_lat,
+            ANY_VALUE(start_lng) AS start_lng,
+            ANY_VALUE(end_lat) AS end_lat,
+            ANY_VALUE(end_lng) AS end_lng
+        FROM batch
+        GROUP BY ALL
+        """,
+        """
+        SELECT
+            start_station_name, end_station_name,
+            SUM(num_trips)::BIGINT AS num_trips,
+            ANY_VALUE(start_lat) AS start_lat, ANY_VALUE(start_lng) AS start_lng,
+            ANY_VALUE(end_lat) AS end_lat, ANY_VALUE(end_lng) AS end_lng
+        FROM {parts}
+        GROUP BY start_station_name, end_station_name
+        """,
+    ),
+    'duration_seconds': (
+        DURATION_HISTOGRAM_QUERY,
+        "SELECT rideable_type, member_casual, seconds, SUM(num_trips)::BIGINT AS num_trips FROM {parts} GROUP BY ALL",
+    ),
+}
+
+
+@contextmanager
+def timed(timings, name):
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+
+def scan_trips(con, trips_path, sampler, batch_size=BATCH_SIZE):
+    # The single pass over the trip data. Creates the DuckDB tables of TOTALS:
+    #   daily            - trips per date
+    #   route_totals     - trips and coordinates per (start, end)
+    #   duration_seconds - trips per (rideable_type, member_casual, duration in seconds)
+    # and feeds every batch to the sampler
+    dataset = ds.dataset(trips_path, format='parquet', partitioning='hive')
+    total_rows = dataset.count_rows()  # from the Parquet footers, no data read
+
+    # empty tables with the columns of the aggregates
+    con.register('batch', dataset.schema.empty_table())
+    for table, (aggregate, _) in TOTALS.items():
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS {aggregate}")
+    con.unregister('batch')
+
+    for batch in dataset.to_batches(batch_size=batch_size):
+        table = pa.Table.from_batches([batch])
+        con.register('batch', table)
+        for name, (aggregate, merge) in TOTALS.items():
+            # the batch's aggregate added into the running totals
+            parts = f"(SELECT * FROM {name} UNION ALL BY NAME ({aggregate}))"
+            con.execute(f"CREATE OR REPLACE TABLE {name} AS {merge.format(parts=parts)}")
+        con.unregister('batch')
+        sampler.add(table)
+    return total_rows
+
+
+def top_20(con):
+    # top 20 stations by number of trips beginning there
+    return con.execute("""
+        SELECT start_station_name, SUM(num_trips)::BIGINT AS num_trips
+        FROM route_totals
+        GROUP BY start_station_name
+        ORDER BY num_trips DESC
+        LIMIT 20
+    """).df()
+
+
+def routes(con):
+    # number of trips per route, with coordinates so it can be used for maps
+    return con.execute("""
+        SELECT
+            CONCAT(start_station_name, '-', end_station_name) AS route,
+            num_trips,
+            start_station_name,
+            end_station_name,
+            start_lng,
+            start_lat,
+            end_lng,
+            end_lat
+        FROM route_totals
+        ORDER BY num_trips DESC
+    """).df()
+
+
+def df_weather(con):
+    # one row per day with number of trips and weather variables (temperature in °C),
+    # weather (the `weather` view, see build_artifacts) joined after counting so it is looked up once per day
+    return con.execute("""
+        SELECT
+            t.date,
+            w.TAVG / 10 AS temperature,
+            w.PRCP AS precipitation,
+            w.AWND AS wind,
+            t.trip_count
+        FROM (
+            SELECT date, num_trips AS trip_count
+            FROM daily
+        ) t
+        LEFT JOIN weather w USING (date)
+        ORDER BY t.date
+    """).df()
+
+
+def df_sample_100(sampler):
+    # Trips under 100 mins sampled during the scan: the same number from every stratum (rideable_type x
+    # member_casual by default), the ones with the smallest hash(ride_id, 1) within each
+    return sampler.result()
+
+
+def duration_box(con):
+    # trip duration box plot statistics per rideable_type and member_casual, over all trips under 100 mins
+    return box_stats(con.execute("SELECT * FROM duration_seconds").df())
+
+
+def build_artifacts(trips_path, output_dir, weather_path=weather_file, batch_size=BATCH_SIZE, sample_size=SAMPLE_SIZE,
+                    strata=STRATA):
+    # Writes all dashboard CSVs, returns {artifact: (seconds, bytes written)} plus the scan time
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    con = duckdb.connect()
+    # before the scan, so a missing weather table can't fail the run halfway through writing the outputs
+    create_weather_view(con, weather_path)
+    timings = {}
+
+    with timed(timings, 'scan'):
+        sampler = StratifiedSampler(sample_size, strata)
+        total_rows = scan_trips(con, trips_path, sampler, batch_size)
+    print(f"Scanned {total_rows:,} trips in {timings['scan']:.1f} s")
+
+    builders = {
+        'top_20.csv': lambda: top_20(con),
+        'routes.csv': lambda: routes(con),
+        'df_weather.csv': lambda: df_weather(con),
+        'df_sample_100.csv': lambda: df_sample_100(sampler),
+        'duration_box.csv': lambda: duration_box(con),
+    }
+    report = {}
+    for filename, build in builders.items():
+        with timed(timings, filename):
+            build().to_csv(output_dir / filename, index=False)
+        report[filename] = (timings[filename], os.path.getsize(output_dir / filename))
+        print(f"{filename:<20} {timings[filename]:6.2f} s {report[filename][1] / 1e6:10.2f} MB")
+    report['scan'] = (timings['scan'], 0)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the dashboard CSVs from one pass over the trip data")
+    parser.add_argument("--trips", type=Path, default=bigfile, help="trip Parquet file or partitioned dataset folder")
+    parser.add_argument("--output", type=Path, default=output_dir)
+    parser.add_argument("--weather", type=Path, default=weather_file, help="daily weather table (wide_weather.csv)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--strata", nargs="*", default=STRATA, help="columns to stratify the sample by, none for a plain sample")
+    args = parser.parse_args()
+
+    build_artifacts(args.trips, args.output, args.weather, batch_size=args.batch_size, strata=args.strata)
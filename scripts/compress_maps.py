@@ -0,0 +1,47 @@
+import argparse
+import gzip
+import os
+import shutil
+from pathlib import Path
+
+# Writes a gzipped copy (<file>.gz) next to each Kepler map export and shared map dataset
+# (kepler_maps.py) used by the dashboards.
+# They are mostly repeated JSON and compress to a fraction of their size, so they take less disk space
+# and the dashboard (dashboard_data.load_html / load_map) reads far fewer bytes from disk; it falls back
+# to the original file whenever that is newer than its compressed copy.
+# The browser still gets the decompressed HTML: Streamlit passes it to components.html as text, so this
+# doesn't make the map pages any smaller to download.
+# Run again after re-saving a map from layered_map.ipynb or routes_map.ipynb.
+
+maps_dir = Path("visualisations")
+
+MAPS = ['routes.html', 'top100_stations.html', 'kepler/*.json']
+
+
+def compress_map(path, level=9):
+    # Returns (original bytes, compressed bytes)
+    path = Path(path)
+    target = path.with_name(path.name + ".gz")
+    tmp = target.with_name(target.name + ".part")
+    with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=level) as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp, target)
+    return path.stat().st_size, target.stat().st_size
+
+
+def compress_maps(maps_dir, names=MAPS):
+    for name in names:
+        paths = sorted(Path(maps_dir).glob(name))
+        if not paths:
+            print(f"{name}: not found, skipped")
+        for path in paths:
+            size, compressed = compress_map(path)
+            print(f"{path.relative_to(maps_dir).as_posix():<40} {size / 1e6:8.2f} MB -> {compressed / 1e6:6.2f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompress the Kepler map exports for the dashboards")
+    parser.add_argument("--maps", type=Path, default=maps_dir)
+    args = parser.parse_args()
+
+    compress_maps(args.maps)
@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# One bundle with every table the dashboards draw, built from the CSV outputs of build_dashboard_artifacts.py
+# / rollups.py (and site_scoring.py), so the dashboard doesn't parse CSVs, dates and sort on a cold start.
+# Each table is stored already typed, sorted and aggregated as an uncompressed Feather (Arrow IPC) file,
+# which the dashboard memory-maps instead of reading: opening the bundle costs next to nothing and only the
+# pages' own tables are ever touched.
+# A build writes a new version folder (v<timestamp>/ with the tables and manifest.json) and then switches
+# current.json to it in one os.replace, so a running dashboard never sees a half-written bundle and keeps
+# its memory-mapped files valid; only the last KEEP_VERSIONS folders are kept.
+# BUNDLE_FORMAT is bumped whenever the tables change shape, and the dashboard refuses a bundle of another format.
+
+source_dir = Path("C:/Data/Citibike_NY_2022/merged")
+bundle_dir = Path("C:/Data/Citibike_NY_2022/merged/dashboard_bundle")
+expansion_scores_path = Path("Data/expansion_scores.csv")
+
+BUNDLE_FORMAT = 1
+KEEP_VERSIONS = 2
+ROUTES_TOP_N = 1000
+DOW_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# bundle table -> CSV it is built from
+SOURCES = {
+    'df_weather': 'df_weather.csv',
+    'avg_trips': 'df_weather.csv',
+    'top_20': 'top_20.csv',
+    'routes': 'routes.csv',
+    'duration_box': 'duration_box.csv',
+    'expansion_scores': 'expansion_scores.csv',
+}
+
+
+def weather_table(df_weather):
+    # Making sure date is datetime and df is sorted by date
+    df_weather = df_weather.assign(date=pd.to_datetime(df_weather['date']))
+    return df_weather.sort_values('date').reset_index(drop=True)
+
+
+def day_of_week_averages(df_weather):
+    # Average daily trips per day of the week, in weekday order (it was starting with Saturday)
+    df_dow = df_weather[['date', 'trip_count']].copy()
+    df_dow['day_of_week'] = pd.to_datetime(df_dow['date']).dt.day_name()
+    avg_trips = df_dow.groupby('day_of_week')['trip_count'].mean().reset_index()
+    avg_trips['day_of_week'] = pd.Categorical(avg_trips['day_of_week'], categories=DOW_ORDER, ordered=True)
+    return avg_trips.sort_values('day_of_week').reset_index(drop=True)
+
+
+def top_routes(routes, n=ROUTES_TOP_N):
+    return routes.sort_values('num_trips', ascending=False, kind='stable').head(n).reset_index(drop=True)
+
+
+def dictionary_encode(df):
+    # Text columns that mostly repeat (borough and neighbourhood names, ...) as categoricals, stored once per
+    # value in the Feather file
+    for col in df.columns:
+        if df[col].dtype == object and df[col].nunique() <= len(df) // 2:
+            df[col] = df[col].astype('category')
+    return df
+
+
+def bundle_tables(source_dir=source_dir, expansion_scores_path=expansion_scores_path):
+    # {table: frame} for every table whose source CSV exists
+    paths = {name: Path(source_dir) / filename for name, filename in SOURCES.items()}
+    paths['expansion_scores'] = Path(expansion_scores_path)
+    builders = {
+        'df_weather': weather_table,
+        'avg_trips': lambda df: day_of_week_averages(weather_table(df)),
+        'top_20': lambda df: df,
+        'routes': top_routes,
+        'duration_box': lambda df: df,
+        'expansion_scores': lambda df: df,
+    }
+    tables = {}
+    for name, build in builders.items():
+        if not paths[name].exists():
+            print(f"{name}: {paths[name]} not found, skipped")
+            continue
+        tables[name] = dictionary_encode(build(pd.read_csv(paths[name], index_col=False)))
+    return tables
+
+
+def current_path(bundle_dir):
+    return Path(bundle_dir) / "current.json"
+
+
+def write_bundle(tables, bundle_dir=bundle_dir, keep=KEEP_VERSIONS):
+    # Writes the tables as a new version and makes it current, returns the version folder
+    bundle_dir = Path(bundle_dir)
+    version = f"v{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}"
+    version_dir = bundle_dir / version
+    version_dir.mkdir(parents=True)
+    manifest = {'format': BUNDLE_FORMAT, 'version': version, 'tables': {}}
+    for name, df in tables.items():
+        # uncompressed, so the file can be memory-mapped as is
+        feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), version_dir / f"{name}.feather",
+                              compression='uncompressed')
+        manifest['tables'][name] = {'file': f"{name}.feather", 'rows': len(df), 'columns': list(df.columns)}
+    with open(version_dir / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    tmp = bundle_dir / "current.json.part"
+    with open(tmp, "w") as f:
+        json.dump({'version': version}, f)
+    os.replace(tmp, current_path(bundle_dir))
+
+    versions = sorted(p for p in bundle_dir.glob("v*") if p.is_dir())
+    for old in versions[:-keep]:
+        shutil.rmtree(old, ignore_errors=True)  # a dashboard on Windows may still have it mapped
+    return version_dir
+
+
+def open_bundle(bundle_dir=bundle_dir):
+    # {table: pyarrow Table} of the current version, memory-mapped (no data is read until it is used)
+    with open(current_path(bundle_dir)) as f:
+        version_dir = Path(bundle_dir) / json.load(f)['version']
+    with open(version_dir / "manifest.json") as f:
+        manifest = json.load(f)
+    if manifest['format'] != BUNDLE_FORMAT:
+        raise ValueError(f"{version_dir} is a format {manifest['format']} bundle, expected format {BUNDLE_FORMAT}: "
+                         f"rebuild it with dashboard_bundle.py")
+    return {
+        name: feather.read_table(version_dir / table['file'], memory_map=True)
+        for name, table in manifest['tables'].items()
+    }
+
+
+def build_bundle(source_dir=source_dir, bundle_dir=bundle_dir, expansion_scores_path=expansion_scores_path):
+    tables = bundle_tables(source_dir, expansion_scores_path)
+    version_dir = write_bundle(tables, bundle_dir)
+    for name, df in tables.items():
+        size = (version_dir / f"{name}.feather").stat().st_size
+        print(f"{name:<18} {len(df):>8,} rows {size / 1e3:10.1f} KB")
+    print(f"Bundle {version_dir.name} written to {bundle_dir}")
+    return version_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the dashboard bundle from the dashboard CSVs")
+    parser.add_argument("--source", type=Path, default=source_dir, help="folder with df_weather.csv, top_20.csv, ...")
+    parser.add_argument("--output", type=Path, default=bundle_dir)
+    parser.add_argument("--scores", type=Path, default=expansion_scores_path, help="expansion_scores.csv")
+    args = parser.parse_args()
+
+    build_bundle(args.source, args.output, args.scores)
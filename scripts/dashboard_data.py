@@ -0,0 +1,96 @@
+import gzip
+import os
+
+import streamlit as st
+
+from dashboard_bundle import current_path, open_bundle
+from kepler_maps import kepler_dir, kepler_template, map_html
+
+# Data loading for the dashboards.
+# Streamlit reruns the whole script on every click, so everything is cached with st.cache_resource: loaded
+# once per process and shared by all sessions (the pages only read these objects, never modify them).
+# The tables come from the bundle written by dashboard_bundle.py, already typed, sorted and aggregated:
+# opening it memory-maps its Feather files and each table is only converted to pandas when a page first
+# asks for it. The bundle's current.json modification time is part of the cache key, so a rebuilt bundle
+# is picked up on the next rerun.
+# The Kepler map exports are cached the same way, so the multi-MB HTML string isn't copied on every
+# rerun, and read from the .html.gz written by compress_maps.py when it is up to date. That only saves
+# disk space and read time: components.html sends the page to the browser as uncompressed text, so the
+# payload over the wire is the same either way.
+# Maps built with kepler_maps.py are assembled from the kepler.gl template and their shared dataset files,
+# which are cached the same way, so the population and income maps keep one copy of the data in memory.
+
+
+def _mtime(path):
+    return os.path.getmtime(path)
+
+
+@st.cache_resource(show_spinner=False)
+def _open_bundle(bundle_dir, mtime):
+    return open_bundle(bundle_dir)
+
+
+@st.cache_resource(show_spinner=False)
+def _bundle_table(bundle_dir, mtime, name):
+    tables = _open_bundle(bundle_dir, mtime)
+    if name not in tables:
+        return None
+    return tables[name].to_pandas()
+
+
+def load_table(bundle_dir, name):
+    # a table of the dashboard bundle as a pandas frame, None if there is no bundle or the bundle doesn't have
+    # it (its CSV wasn't there when the bundle was built, e.g. the trip-based tables in the bundle committed
+    # under Data/)
+    if not os.path.exists(current_path(bundle_dir)):
+        return None
+    return _bundle_table(str(bundle_dir), _mtime(current_path(bundle_dir)), name)
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _read_text(path, mtime):
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return f.read()
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _text_source(path):
+    # the precompressed copy, unless the export has been re-saved since it was compressed
+    gz_path = path + '.gz'
+    if os.path.exists(gz_path) and (not os.path.exists(path) or _mtime(gz_path) >= _mtime(path)):
+        return gz_path
+    return path
+
+
+def _load_text(path):
+    source = _text_source(str(path))
+    return _read_text(source, _mtime(source))
+
+
+@st.cache_resource(show_spinner=False)
+def _kepler_template():
+    return kepler_template()
+
+
+def load_html(path):
+    # contents of a map export for st.components.v1.html
+    return _load_text(path)
+
+
+def load_map(view, maps_dir=kepler_dir):
+    # page for a kepler_maps.py view, for st.components.v1.html
+    return map_html(view, maps_dir, read_text=_load_text, template=_kepler_template())
+
+
+class LazyData:
+    # Dataset name -> loader, called on first access only, so a page only reads the files it uses
+    def __init__(self, loaders):
+        self.loaders = loaders
+        self.loaded = {}
+
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            self.loaded[name] = self.loaders[name]()
+        return self.loaded[name]
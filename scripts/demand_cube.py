@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+from datetime import date, timedelta
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+# Departures and arrivals per station, day and hour of day as two dense NumPy cubes
+# (stations x days x 24), for hour-level questions - rush-hour profiles, when a station fills up or
+# empties - that the daily totals in df_weather.csv can't answer.
+# The cubes are built with one DuckDB aggregation over the trip Parquet data (per station and hour since
+# 1970 on the started_at / ended_at seconds, which are local time) and saved as uint16 .npy files:
+# ~1,800 stations x 365 days x 24 hours is about 32 MB per cube, and DemandCube opens them memory-mapped,
+# so a station's profile or the net flow of a few weeks is array slicing without reading the rest.
+# The day axis covers the dates of the trips' departures; arrivals after the last day are left out.
+
+trips_path = Path(r"C:\Data\Citibike_NY_2022\merged\df_weather_duration.parquet")
+cube_dir = Path(r"C:\Data\Citibike_NY_2022\merged\demand_cube")
+
+# cube -> (station column, time column) of the trips
+KINDS = {'departures': ('start_station_name', 'started_at'), 'arrivals': ('end_station_name', 'ended_at')}
+COUNT_DTYPE = np.uint16
+HOURS = 24
+
+# trips per station and hour since 1970
+HOURLY_QUERY = """
+    SELECT {station_column} AS station_name, {time_column} // 3600 AS hour_index, COUNT(*) AS num_trips
+    FROM read_parquet('{path}')
+    WHERE {station_column} IS NOT NULL
+    GROUP BY ALL
+"""
+
+
+def _parquet_glob(path):
+    path = Path(path)
+    return f"{path.as_posix()}/**/*.parquet" if path.is_dir() else path.as_posix()
+
+
+def build_cube(trips_path=trips_path, cube_dir=cube_dir):
+    # Writes departures.npy, arrivals.npy, stations.csv and meta.json to cube_dir, returns the DemandCube
+    con = duckdb.connect()
+    counts = {
+        kind: con.execute(HOURLY_QUERY.format(station_column=station_column, time_column=time_column,
+                                              path=_parquet_glob(trips_path))).df()
+        for kind, (station_column, time_column) in KINDS.items()
+    }
+    stations = np.sort(pd.concat([df['station_name'] for df in counts.values()]).astype(str).unique())
+    first_day = int(counts['departures']['hour_index'].min() // HOURS)
+    n_days = int(counts['departures']['hour_index'].max() // HOURS) - first_day + 1
+
+    cube_dir = Path(cube_dir)
+    cube_dir.mkdir(parents=True, exist_ok=True)
+    for kind, df in counts.items():
+        station_idx = np.searchsorted(stations, df['station_name'].astype(str).to_numpy())
+        day_idx, hour = np.divmod(df['hour_index'].to_numpy(np.int64) - first_day * HOURS, HOURS)
+        inside = (day_idx >= 0) & (day_idx < n_days)
+        cell = (station_idx[inside] * n_days + day_idx[inside]) * HOURS + hour[inside]
+        cube = np.bincount(cell, weights=df['num_trips'].to_numpy()[inside], minlength=len(stations) * n_days * HOURS)
+        cube = cube.astype(np.int64).reshape(len(stations), n_days, HOURS)
+        limit = np.iinfo(COUNT_DTYPE).max
+        if cube.max() > limit:
+            print(f"{kind}: {int((cube > limit).sum())} station hours over {limit:,} trips, capped")
+        tmp = cube_dir / f"{kind}.part.npy"
+        np.save(tmp, np.minimum(cube, limit).astype(COUNT_DTYPE))
+        os.replace(tmp, cube_dir / f"{kind}.npy")
+
+    pd.DataFrame({'station_name': stations}).to_csv(cube_dir / "stations.csv", index=False)
+    with open(cube_dir / "meta.json", "w") as f:
+        json.dump({'first_day': (date(1970, 1, 1) + timedelta(days=first_day)).isoformat(), 'days': n_days}, f, indent=2)
+    return DemandCube(cube_dir)
+
+
+class DemandCube:
+    def __init__(self, cube_dir=cube_dir):
+        cube_dir = Path(cube_dir)
+        self.cubes = {kind: np.load(cube_dir / f"{kind}.npy", mmap_mode='r') for kind in KINDS}
+        self.stations = pd.read_csv(cube_dir / "stations.csv", dtype=str, keep_default_na=False)['station_name'].to_numpy()
+        self.station_index = pd.Index(self.stations)
+        with open(cube_dir / "meta.json") as f:
+            meta = json.load(f)
+        self.first_day = date.fromisoformat(meta['first_day'])
+        self.dates = pd.date_range(self.first_day, periods=meta['days'], freq='D')
+
+    def station(self, name):
+        # position of a station on the first axis
+        return self.station_index.get_loc(name)
+
+    def days(self, start=None, end=None, weekdays=None):
+        # Positions on the day axis between start and end (inclusive), optionally only weekdays
+        # (weekdays=True) or weekends (False)
+        mask = np.ones(len(self.dates), dtype=bool)
+        if start is not None:
+            mask &= self.dates >= pd.Timestamp(start)
+        if end is not None:
+            mask &= self.dates <= pd.Timestamp(end)
+        if weekdays is not None:
+            mask &= (self.dates.dayofweek < 5) == weekdays
+        return np.flatnonzero(mask)
+
+    def _select(self, kind, stations=None, days=None):
+        # stations x days x 24 slice (a view when both are None or slices)
+        cube = self.cubes[kind]
+        if stations is not None:
+            names = stations if isinstance(stations, (list, tuple)) else [stations]
+            cube = cube[[self.station(name) for name in names]]
+        if days is not None:
+            cube = cube[:, days]
+        return cube
+
+    def hourly_profile(self, station, kind='departures', days=None, average=True):
+        # Trips per hour of day at one station, averaged (or summed) over the selected days
+        counts = self._select(kind, station, days)[0]
+        return counts.mean(axis=0) if average else counts.sum(axis=0, dtype=np.int64)
+
+    def profiles(self, kind='departures', days=None, average=True):
+        # Stations x hours frame of hourly_profile for every station
+        counts = self._select(kind, days=days)
+        values = counts.mean(axis=1) if average else counts.sum(axis=1, dtype=np.int64)
+        return pd.DataFrame(values, index=pd.Index(self.stations, name='station_name'), columns=range(HOURS))
+
+    def net_flow(self, station=None, days=None, average=True):
+        # Arrivals minus departures per hour of day (positive: bikes pile up, negative: the station empties),
+        # for one station as an array or for every station as a stations x hours frame
+        if station is not None:
+            return (self.hourly_profile(station, 'arrivals', days, average)
+                    - self.hourly_profile(station, 'departures', days, average))
+        return self.profiles('arrivals', days, average) - self.profiles('departures', days, average)
+
+    def daily_hours(self, station, kind='departures', days=None):
+        # One row per day, one column per hour, for a single station
+        index = self.dates if days is None else self.dates[days]
+        return pd.DataFrame(np.asarray(self._select(kind, station, days)[0]), index=index, columns=range(HOURS))
+
+    def city_hourly(self, kind='departures', days=None, average=True):
+        # Trips per hour of day over all stations
+        counts = self._select(kind, days=days).sum(axis=0, dtype=np.int64)
+        return counts.mean(axis=0) if average else counts.sum(axis=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the station x day x hour departure and arrival cubes")
+    parser.add_argument("--trips", type=Path, default=trips_path, help="trip Parquet file or partitioned dataset folder")
+    parser.add_argument("--output", type=Path, default=cube_dir)
+    args = parser.parse_args()
+
+    cube = build_cube(args.trips, args.output)
+    n_stations, n_days, _ = cube.cubes['departures'].shape
+    print(f"{n_stations:,} stations x {n_days} days x {HOURS} hours from {cube.first_day}")
+    weekday = cube.city_hourly(days=cube.days(weekdays=True))
+    print(f"Busiest weekday hours: {', '.join(f'{h}:00' for h in np.argsort(weekday)[::-1][:3])}")
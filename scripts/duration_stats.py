@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# Box plot statistics of trip duration per (rideable_type, member_casual) over all trips, so the dashboard's
+# membership page draws a few precomputed boxes instead of sending 100k sampled rows to the browser for
+# Plotly to work out the quartiles on every render.
+# Durations are whole seconds (trip_duration is (ended_at - started_at) / 60 on second timestamps), so the
+# sketch kept while streaming the trips is simply the number of trips per group and second: under
+# MAX_DURATION that is at most 6,000 counters per group, it merges by adding counts (across batches, trip
+# files or months) and the quartiles and whiskers read off it are exact.
+# Outliers are only kept as distinct values rounded to OUTLIER_STEP minutes - enough to draw them, without
+# a point per trip.
+
+BOX_GROUPS = ['rideable_type', 'member_casual']
+MAX_DURATION = 100  # minutes, longer trips are left out as in the sampled box plot
+OUTLIER_STEP = 0.5  # minutes
+
+
+def duration_histogram_query(source='batch', keys=()):
+    # Trips per group and duration in seconds over a table or view of trips, also grouped by the SQL
+    # expressions in keys (e.g. the month in the rollup store)
+    key_columns = ''.join(f"{key},\n        " for key in keys)
+    return f"""
+    SELECT
+        {key_columns}rideable_type,
+        member_casual,
+        CAST(ROUND(trip_duration * 60) AS INTEGER) AS seconds,
+        COUNT(*) AS num_trips
+    FROM {source}
+    WHERE trip_duration >= 0 AND trip_duration < {MAX_DURATION}
+    GROUP BY ALL
+"""
+
+
+# trips per group and duration in seconds, over a table or view of trips named `batch`
+DURATION_HISTOGRAM_QUERY = duration_histogram_query()
+
+
+BOX_COLUMNS = ['num_trips', 'lowerfence', 'q1', 'median', 'q3', 'upperfence', 'mean', 'outliers']
+
+
+def _quantile(values, cumulative, q):
+    # Quantile of the trips with sorted distinct `values` and cumulative counts, interpolated between the
+    # two nearest trips as pandas' quantile() does
+    position = q * (cumulative[-1] - 1)
+    lower, upper = np.searchsorted(cumulative, [np.floor(position), np.ceil(position)], side='right')
+    return values[lower] + (values[upper] - values[lower]) * (position - np.floor(position))
+
+
+def group_box_stats(seconds, counts, outlier_step=OUTLIER_STEP):
+    # Box statistics (in minutes) of one group from its trips per duration in seconds.
+    # Whiskers end at the furthest trips within 1.5 IQR of the box, as in Plotly's own box plots
+    order = np.argsort(seconds)
+    values, counts = np.asarray(seconds)[order] / 60, np.asarray(counts)[order]
+    cumulative = np.cumsum(counts)
+    q1, median, q3 = (_quantile(values, cumulative, q) for q in (0.25, 0.5, 0.75))
+    iqr = q3 - q1
+    inside = (values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)
+    # rounded away from the box, so no outlier is drawn inside the whiskers
+    low, high = values[~inside & (values < q1)], values[~inside & (values > q3)]
+    outliers = np.unique(np.r_[np.floor(low / outlier_step), np.ceil(high / outlier_step)] * outlier_step)
+    return {
+        'num_trips': int(cumulative[-1]),
+        'lowerfence': values[inside].min(),
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'upperfence': values[inside].max(),
+        'mean': (values * counts).sum() / cumulative[-1],
+        'outliers': ' '.join(f'{v:g}' for v in outliers),
+    }
+
+
+def box_stats(histogram, groups=BOX_GROUPS, outlier_step=OUTLIER_STEP):
+    # Trips per group and second (DURATION_HISTOGRAM_QUERY, partial counts may repeat) -> one row per group
+    # with BOX_COLUMNS, outliers as a space separated string of minutes
+    totals = histogram.groupby([*groups, 'seconds'], observed=True, sort=False)['num_trips'].sum().reset_index()
+    rows = []
+    for keys, group in totals.groupby(groups, observed=True, sort=True):
+        stats = group_box_stats(group['seconds'].to_numpy(), group['num_trips'].to_numpy(), outlier_step)
+        rows.append({**dict(zip(groups, keys)), **stats})
+    stats = pd.DataFrame(rows, columns=[*groups, *BOX_COLUMNS])
+    return stats.round({col: 3 for col in ['lowerfence', 'q1', 'median', 'q3', 'upperfence', 'mean']})
+
+
+def box_figure(stats, x='rideable_type', color='member_casual', color_discrete_map=None, title=None, labels=None):
+    # Grouped box plot from box_stats output (e.g. duration_box.csv): one trace per value of `color`,
+    # boxes drawn from the precomputed statistics and the outliers as points
+    labels = labels or {}
+    fig = go.Figure()
+    for name, group in stats.groupby(color, observed=True, sort=False):
+        outliers = group['outliers'].fillna('').astype(str)
+        fig.add_trace(go.Box(
+            name=str(name),
+            x=group[x],
+            q1=group['q1'], median=group['median'], q3=group['q3'],
+            lowerfence=group['lowerfence'], upperfence=group['upperfence'], mean=group['mean'],
+            y=[[float(v) for v in values.split()] for values in outliers],
+            boxpoints='outliers',
+            marker_color=(color_discrete_map or {}).get(name),
+            hoverinfo='skip',
+        ))
+    fig.update_layout(
+        boxmode='group',
+        title=title,
+        xaxis_title=labels.get(x, x),
+        yaxis_title=labels.get('trip_duration', 'trip_duration'),
+        legend_title=labels.get(color, color),
+    )
+    return fig
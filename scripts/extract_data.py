@@ -1,20 +1,101 @@
+import argparse
+import os
+import shutil
 import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from pipeline_config import system_settings
+
 source_dir = Path(r"C:\Data\Citibike_NY_2022\2022-citibike-tripdata")
 target_dir = Path(r"C:\Data\Citibike_NY_2022\2022-citibike-tripdata\extracted_data")
-target_dir.mkdir(exist_ok=True)
 
-for zip_file in source_dir.glob("*.zip"):
+CHUNK_SIZE = 16 * 1024 * 1024  # 16 MB per read, so a whole member is never held in memory
+
+
+def output_name(zip_stem, member):
+    # Prefixing the zip name, without repeating it if the member already starts with it
+    member_name = Path(member).name
+    if member_name.startswith(zip_stem):
+        member_name = member_name[len(zip_stem):].lstrip('_-')
+    return f"{zip_stem}_{member_name}"
+
+
+def file_crc32(path, chunk_size=CHUNK_SIZE):
+    crc = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def is_up_to_date(target, info, chunk_size=CHUNK_SIZE):
+    # Size is checked first so the CRC is only computed for likely matches
+    if not target.exists() or target.stat().st_size != info.file_size:
+        return False
+    return file_crc32(target, chunk_size) == info.CRC
+
+
+def extract_zip(zip_file, target_dir, chunk_size=CHUNK_SIZE):
+    # Extracts the CSV members of one monthly zip, returns (extracted, skipped) counts
+    extracted, skipped = 0, 0
     with zipfile.ZipFile(zip_file) as zip_ref:
-        zip_stem = zip_file.stem
-        for member in zip_ref.namelist():
-            if member.endswith('.csv'):
-                member_name = Path(member).name
-                if member_name.startswith(zip_stem):
-                    member_name = member_name[len(zip_stem):].lstrip('_-')
-                output_filename = f"{zip_stem}_{member_name}"
-                with zip_ref.open(member) as src, open(target_dir / output_filename, "wb") as dst:
-                    dst.write(src.read())
-
-print(f"All CSV files extracted to {target_dir}")
\ No newline at end of file
+        zip_stem = Path(zip_file).stem
+        for info in zip_ref.infolist():
+            if not info.filename.endswith('.csv'):
+                continue
+            target = Path(target_dir) / output_name(zip_stem, info.filename)
+            if is_up_to_date(target, info, chunk_size):
+                skipped += 1
+                continue
+            # Writing to a temp file first so an interrupted run never leaves a half file that looks complete
+            tmp = target.with_name(target.name + ".part")
+            with zip_ref.open(info) as src, open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst, chunk_size)
+            os.replace(tmp, target)
+            extracted += 1
+    return extracted, skipped
+
+
+def extract_all(source_dir, target_dir, workers=None, chunk_size=CHUNK_SIZE, pattern="*.zip"):
+    target_dir = Path(target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    zip_files = sorted(Path(source_dir).glob(pattern))
+
+    # One zip per task, spread across processes
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            zip_file: pool.submit(extract_zip, zip_file, target_dir, chunk_size)
+            for zip_file in zip_files
+        }
+        totals = [0, 0]
+        for zip_file, future in futures.items():
+            extracted, skipped = future.result()
+            totals[0] += extracted
+            totals[1] += skipped
+            print(f"{zip_file.name}: {extracted} extracted, {skipped} already up to date")
+    return tuple(totals)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract Citibike trip CSVs from the monthly zip files")
+    parser.add_argument("--source", type=Path, default=source_dir)
+    parser.add_argument("--target", type=Path, default=target_dir)
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: one per CPU)")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_SIZE // (1024 * 1024))
+    parser.add_argument("--system", default=None, help="take the zips of --year of this system of pipeline.json instead")
+    parser.add_argument("--year", type=int, default=None)
+    args = parser.parse_args()
+
+    pattern = "*.zip"
+    if args.system is not None:
+        # source folder and zip pattern of the system in the pipeline config, extracted next to the zips
+        settings = system_settings(args.system)
+        year = args.year or settings['years'][-1]
+        args.source = Path(settings['source'].format(root=settings['root'], year=year))
+        args.target = args.source / "extracted_data"
+        pattern = settings.get('zip_pattern', pattern).format(year=year)
+
+    extracted, skipped = extract_all(args.source, args.target, args.workers, args.chunk_mb * 1024 * 1024, pattern)
+    print(f"All CSV files extracted to {args.target} ({extracted} extracted, {skipped} skipped)")
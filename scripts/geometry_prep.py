@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+# Shrinks the map layers (NTA polygons, subway lines and stations) before they are embedded in the Kepler maps.
+# Each layer is simplified in NY State Plane (EPSG:2263, feet) so the tolerance is a real distance,
+# reprojected to WGS84 once (which is what Kepler draws anyway) and its coordinates snapped to a grid of
+# `precision` decimal places (5 decimals is about 1 m). The NTAs cover the city without gaps, so they are
+# simplified as a coverage: the border between two neighbourhoods is simplified once for both of them
+# and no slivers or overlaps appear between them.
+
+nta_path = Path("Data/nta_pop_inc.geojson")
+subway_lines_path = Path("subway_lines.geojson")
+subway_stations_path = Path("subway_stations.geojson")
+
+TOLERANCE_M = 10
+PRECISION = 5
+FEET_PER_M = 1 / 0.3048
+
+
+def web_path(path):
+    # nta_pop_inc.geojson -> nta_pop_inc_web.geojson
+    path = Path(path)
+    return path.with_name(f"{path.stem}_web{path.suffix}")
+
+
+def vertex_count(gdf):
+    return int(shapely.get_num_coordinates(gdf.geometry.values).sum())
+
+
+def simplify_layer(gdf, tolerance_m=TOLERANCE_M, precision=PRECISION):
+    # Simplified copy of gdf in EPSG:4326, coordinates rounded to `precision` decimals
+    projected = gdf.to_crs(epsg=2263)
+    geoms = np.asarray(projected.geometry.values)
+    tolerance = tolerance_m * FEET_PER_M
+    if tolerance > 0:
+        polygonal = projected.geom_type.isin(['Polygon', 'MultiPolygon'])
+        if polygonal.all():
+            # snapping to 0.01 ft first joins neighbouring borders that differ only by rounding noise,
+            # otherwise coverage_simplify treats them as separate edges and can open small overlaps
+            geoms = shapely.coverage_simplify(shapely.set_precision(geoms, 0.01), tolerance)
+        else:
+            geoms = shapely.simplify(geoms, tolerance, preserve_topology=True)
+    simplified = projected.set_geometry(gpd.GeoSeries(geoms, index=projected.index, crs=projected.crs)).to_crs(epsg=4326)
+    gridded = shapely.set_precision(np.asarray(simplified.geometry.values), 10.0 ** -precision)
+    return simplified.set_geometry(gpd.GeoSeries(gridded, index=simplified.index, crs=4326))
+
+
+def prepare_file(source, target=None, tolerance_m=TOLERANCE_M, precision=PRECISION):
+    # Writes the simplified layer (by default next to the source as <name>_web.geojson)
+    # and returns (bytes before, bytes after, vertices before, vertices after)
+    target = web_path(source) if target is None else Path(target)
+    gdf = gpd.read_file(source)
+    simplified = simplify_layer(gdf, tolerance_m, precision)
+    # written compactly (no indentation or spaces), coordinates are already rounded by set_precision
+    with open(target, "w", encoding="utf-8") as f:
+        json.dump(simplified.to_geo_dict(drop_id=True), f, separators=(',', ':'))
+    return os.path.getsize(source), os.path.getsize(target), vertex_count(gdf), vertex_count(simplified)
+
+
+def prepare_layers(paths, tolerance_m=TOLERANCE_M, precision=PRECISION):
+    for path in paths:
+        size, new_size, vertices, new_vertices = prepare_file(path, None, tolerance_m, precision)
+        print(f"{Path(path).name:<24} {size / 1e6:6.2f} MB -> {new_size / 1e6:6.2f} MB, "
+              f"{vertices:,} -> {new_vertices:,} vertices")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simplify and quantize the NTA and subway map layers")
+    parser.add_argument("paths", nargs="*", type=Path, default=[nta_path, subway_lines_path, subway_stations_path])
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE_M, help="simplification tolerance in metres")
+    parser.add_argument("--precision", type=int, default=PRECISION, help="decimal places kept in the coordinates")
+    args = parser.parse_args()
+
+    prepare_layers(args.paths, args.tolerance, args.precision)
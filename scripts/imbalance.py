@@ -0,0 +1,144 @@
+import argparse
+import time
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+# Intra-day imbalance per station: how far each station's bike count drifts during the day, which the
+# yearly no_return_pc in station_summary.csv (arrivals vs departures over the whole year) can't show -
+# a station can balance out over the day and still run empty every morning.
+# Every departure is -1 and every arrival +1 bike at the station. The trips are read one month at a time
+# (departures by started_at, arrivals by ended_at, so a trip over midnight counts on both days), the events
+# are put in time order per station and day, and a cumulative sum gives the running change in inventory
+# since midnight for all stations at once. Its minimum is the day's peak deficit (bikes that had to be there
+# at the start of the day, or be brought in) and its maximum the peak surplus (free docks needed, or bikes
+# to take away) - what a rebalancing truck has to cover. Counts restart at midnight, when most rebalancing
+# happens. Events in the same second are taken departures first, so deficits are never understated.
+# The days covered are the months of the trips' departures; arrivals after the last one are left out, as in
+# demand_cube.py.
+
+trips_path = Path(r"C:\Data\Citibike_NY_2022\merged\df_weather_duration.parquet")
+output_path = Path(r"C:\Data\Citibike_NY_2022\merged\station_day_imbalance.parquet")
+summary_path = Path(r"C:\Data\Citibike_NY_2022\merged\station_imbalance.csv")
+
+SECONDS_PER_DAY = 86400
+NEED_THRESHOLD = 5  # bikes; a day whose peak deficit or surplus reaches this counts as needing rebalancing
+
+EVENT_QUERY = """
+    SELECT {station_column} AS station_name, {time_column} AS t
+    FROM read_parquet('{path}')
+    WHERE {station_column} IS NOT NULL AND {time_column} >= {start} AND {time_column} < {end}
+"""
+
+
+def _parquet_glob(path):
+    path = Path(path)
+    return f"{path.as_posix()}/**/*.parquet" if path.is_dir() else path.as_posix()
+
+
+def month_ranges(first_second, last_second):
+    # [start, end) in epoch seconds for every calendar month between the two timestamps
+    first = pd.Timestamp(first_second, unit='s').to_period('M')
+    last = pd.Timestamp(last_second, unit='s').to_period('M')
+    months = pd.period_range(first, last, freq='M')
+    starts = [int(m.start_time.timestamp()) for m in months]
+    ends = [int((m + 1).start_time.timestamp()) for m in months]
+    return list(zip(starts, ends))
+
+
+def daily_imbalance(station_codes, times, deltas, n_stations):
+    # Peak deficit / surplus per (station, day) from events with station code, epoch second and +1/-1.
+    # -> frame with station code, day (days since 1970), departures, arrivals, net, peak_deficit, peak_surplus
+    day = times // SECONDS_PER_DAY
+    group = day * n_stations + station_codes
+    # time order within each station-day, departures (-1) before arrivals (+1) in the same second
+    order = np.lexsort((deltas, times, group))
+    group, deltas = group[order], deltas[order]
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+
+    running = np.cumsum(deltas, dtype=np.int64)
+    # running change since the start of each group: subtract the total before the group
+    before = np.r_[0, running[starts[1:] - 1]]
+    running -= np.repeat(before, np.diff(np.r_[starts, len(group)]))
+
+    arrivals = np.add.reduceat((deltas > 0).astype(np.int64), starts)
+    sizes = np.diff(np.r_[starts, len(group)])
+    keys = group[starts]
+    return pd.DataFrame({
+        'station': keys % n_stations,
+        'day': keys // n_stations,
+        'departures': sizes - arrivals,
+        'arrivals': arrivals,
+        'net': running[np.r_[starts[1:], len(group)] - 1],
+        # the day starts at 0, so a station that only gains bikes has no deficit and vice versa
+        'peak_deficit': -np.minimum(np.minimum.reduceat(running, starts), 0),
+        'peak_surplus': np.maximum(np.maximum.reduceat(running, starts), 0),
+    })
+
+
+def station_day_imbalance(trips_path=trips_path):
+    # One row per station and day with trips out and in, the net change and the peak deficit and surplus,
+    # computed a month of trips at a time
+    con = duckdb.connect()
+    path = _parquet_glob(trips_path)
+    stations = pd.Index(np.sort(np.array([row[0] for row in con.execute(f"""
+        SELECT DISTINCT start_station_name FROM read_parquet('{path}') WHERE start_station_name IS NOT NULL
+        UNION
+        SELECT DISTINCT end_station_name FROM read_parquet('{path}') WHERE end_station_name IS NOT NULL
+    """).fetchall()], dtype=object)))
+    first, last = con.execute(f"SELECT MIN(started_at), MAX(started_at) FROM read_parquet('{path}')").fetchone()
+
+    days = []
+    for start, end in month_ranges(first, last):
+        events = []
+        for station_column, time_column, delta in [('start_station_name', 'started_at', -1),
+                                                   ('end_station_name', 'ended_at', 1)]:
+            df = con.execute(EVENT_QUERY.format(station_column=station_column, time_column=time_column,
+                                                path=path, start=start, end=end)).df()
+            codes = stations.get_indexer(df['station_name'].astype(str))
+            events.append((codes, df['t'].to_numpy(np.int64), np.full(len(df), delta, dtype=np.int8)))
+        codes, times, deltas = (np.concatenate(parts) for parts in zip(*events))
+        if len(codes):
+            days.append(daily_imbalance(codes, times, deltas, len(stations)))
+
+    result = pd.concat(days, ignore_index=True)
+    result.insert(0, 'station_name', stations[result.pop('station')])
+    result.insert(1, 'date', pd.to_datetime(result.pop('day'), unit='D'))
+    return result.sort_values(['station_name', 'date'], kind='stable').reset_index(drop=True)
+
+
+def station_imbalance_summary(station_days, need_threshold=NEED_THRESHOLD):
+    # Per station: average daily trips, the yearly balance as in station_summary.csv and the intra-day
+    # peaks (mean and 90th percentile over the days) with the share of days needing rebalancing
+    needs = (station_days['peak_deficit'] >= need_threshold) | (station_days['peak_surplus'] >= need_threshold)
+    grouped = station_days.assign(needs_rebalancing=needs).groupby('station_name', sort=True)
+    summary = pd.DataFrame({
+        'days': grouped.size(),
+        'daily_deps': grouped['departures'].mean(),
+        'no_return_pc': (grouped['departures'].sum() - grouped['arrivals'].sum()) * 100
+                        / grouped['departures'].sum().replace(0, np.nan),
+        'mean_peak_deficit': grouped['peak_deficit'].mean(),
+        'p90_peak_deficit': grouped['peak_deficit'].quantile(0.9),
+        'mean_peak_surplus': grouped['peak_surplus'].mean(),
+        'p90_peak_surplus': grouped['peak_surplus'].quantile(0.9),
+        'rebalancing_days_pc': grouped['needs_rebalancing'].mean() * 100,
+    })
+    return summary.round(1).reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak intra-day deficit and surplus of bikes per station and day")
+    parser.add_argument("--trips", type=Path, default=trips_path, help="trip Parquet file or partitioned dataset folder")
+    parser.add_argument("--output", type=Path, default=output_path, help="station x day table (Parquet)")
+    parser.add_argument("--summary", type=Path, default=summary_path, help="per station summary (CSV)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    station_days = station_day_imbalance(args.trips)
+    station_days.to_parquet(args.output, index=False)
+    summary = station_imbalance_summary(station_days)
+    summary.to_csv(args.summary, index=False)
+    print(f"{len(station_days):,} station days in {time.perf_counter() - start:.1f} s")
+    print(summary.sort_values('mean_peak_deficit', ascending=False).head(10).to_string(index=False))
@@ -0,0 +1,121 @@
+import argparse
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from trip_schema import (CSV_COLUMN_TYPES, LEGACY_CSV_COLUMN_TYPES, TRIP_SCHEMA, is_legacy_header,
+                         legacy_to_trip_schema, to_trip_schema)
+
+source_dir = Path(r"C:\Data\Citibike_NY_2022\2022-citibike-tripdata")
+dataset_dir = Path(r"C:\Data\Citibike_NY_2022\merged\trips")
+
+BLOCK_SIZE = 64 * 1024 * 1024  # bytes of CSV parsed per batch
+
+
+def file_month(name):
+    # Trip files are named like 202201-citibike-tripdata.zip or JC-202201-citibike-tripdata.csv -> '2022-01',
+    # None if the name has no YYYYMM month
+    match = re.search(r"(\d{4})(0[1-9]|1[0-2])", Path(name).name)
+    return None if match is None else f"{match.group(1)}-{match.group(2)}"
+
+
+def zip_members(zip_ref, zip_file):
+    # {month: CSV members} of a zip; members are dated by their own name (yearly archives hold a year of
+    # monthly files), else by the zip's
+    members = {}
+    for member in sorted(zip_ref.namelist()):
+        if not member.endswith('.csv') or Path(member).name.startswith('._'):
+            continue
+        month = file_month(member) or file_month(zip_file)
+        if month is None:
+            raise ValueError(f"Can't find a YYYYMM month in {member} or {zip_file}")
+        members.setdefault(month, []).append(member)
+    return members
+
+
+def iter_trip_batches(zip_ref, member, block_size=BLOCK_SIZE):
+    # Streams one CSV member of a zip, one parsed batch at a time.
+    # Column types are declared up front (see trip_schema.py) instead of inferred per file -
+    # station ids have to stay strings, some are like 'JC013' and inference would turn the rest into floats.
+    # Files in the pre-2021 layout are recognised by their header and converted to the same schema.
+    # Empty fields (trips without an end station, ...) are read as null, not as a '' station
+    with zip_ref.open(member) as src:
+        legacy = is_legacy_header(src.readline().decode('utf-8-sig').strip())
+    column_types, convert = (LEGACY_CSV_COLUMN_TYPES, legacy_to_trip_schema) if legacy else (CSV_COLUMN_TYPES, to_trip_schema)
+    read_options = pacsv.ReadOptions(block_size=block_size)
+    convert_options = pacsv.ConvertOptions(column_types=column_types, include_columns=list(column_types),
+                                           strings_can_be_null=True)
+    with zip_ref.open(member) as src:
+        reader = pacsv.open_csv(src, read_options=read_options, convert_options=convert_options)
+        for batch in reader:
+            yield convert(batch)
+
+
+def _targets(zip_file, months, dataset_dir):
+    return {month: Path(dataset_dir) / f"month={month}" / f"{Path(zip_file).stem}.parquet" for month in months}
+
+
+def is_ingested(zip_file, dataset_dir):
+    # True if every month of the zip has been written since the zip last changed
+    with zipfile.ZipFile(zip_file) as zip_ref:
+        targets = _targets(zip_file, zip_members(zip_ref, zip_file), dataset_dir).values()
+    zip_time = Path(zip_file).stat().st_mtime_ns
+    return all(target.exists() and target.stat().st_mtime_ns >= zip_time for target in targets)
+
+
+def ingest_zip(zip_file, dataset_dir, block_size=BLOCK_SIZE):
+    # Writes one zip to dataset_dir/month=YYYY-MM/<zip stem>.parquet (a file per month it covers), replacing
+    # any earlier run. Returns the number of trips
+    rows = 0
+    with zipfile.ZipFile(zip_file) as zip_ref:
+        members = zip_members(zip_ref, zip_file)
+        for month, target in _targets(zip_file, members, dataset_dir).items():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(target.name + ".part")
+            with pq.ParquetWriter(tmp, TRIP_SCHEMA, compression='zstd') as writer:
+                for member in members[month]:
+                    for batch in iter_trip_batches(zip_ref, member, block_size):
+                        writer.write_batch(batch)
+                        rows += batch.num_rows
+            os.replace(tmp, target)
+    return rows
+
+
+def ingest_files(zip_files, dataset_dir, workers=None, block_size=BLOCK_SIZE, force=False):
+    # One zip per task, spread across processes; zips that are already ingested are skipped unless force
+    if not force:
+        zip_files = [zip_file for zip_file in zip_files if not is_ingested(zip_file, dataset_dir)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            zip_file: pool.submit(ingest_zip, zip_file, dataset_dir, block_size)
+            for zip_file in zip_files
+        }
+        total = 0
+        for zip_file, future in futures.items():
+            rows = future.result()
+            total += rows
+            print(f"{Path(zip_file).name}: {rows:,} trips")
+    return total
+
+
+def ingest_all(source_dir, dataset_dir, workers=None, block_size=BLOCK_SIZE, pattern="*.zip", force=False):
+    return ingest_files(sorted(Path(source_dir).glob(pattern)), dataset_dir, workers, block_size, force)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load Citibike trips straight from the monthly zips into a month-partitioned Parquet dataset")
+    parser.add_argument("--source", type=Path, default=source_dir)
+    parser.add_argument("--target", type=Path, default=dataset_dir)
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: one per CPU)")
+    parser.add_argument("--block-mb", type=int, default=BLOCK_SIZE // (1024 * 1024))
+    parser.add_argument("--pattern", default="*.zip", help="zip files to load, e.g. 'JC-*.zip'")
+    parser.add_argument("--force", action="store_true", help="reload zips even if they haven't changed")
+    args = parser.parse_args()
+
+    total = ingest_all(args.source, args.target, args.workers, args.block_mb * 1024 * 1024, args.pattern, args.force)
+    print(f"{total:,} trips written to {args.target}")
@@ -0,0 +1,81 @@
+import json
+import re
+from importlib.resources import files
+from pathlib import Path
+
+from keplergl.keplergl import data_to_json
+
+# Kepler maps built from shared data files instead of one self-contained export per map.
+# save_to_html writes the kepler.gl bundle (~11 MB) plus a full copy of every dataset into each HTML
+# file, so the population and income maps of layered_map.ipynb shipped the stations, subway network
+# and NTA geometry twice. Here every dataset is serialised once to <kepler_dir>/<dataset>.json and a
+# map ("view") is just a saved config, <kepler_dir>/views/<view>.json. The HTML page for a view is
+# assembled when it is shown (dashboard_data.load_map), from the datasets its layers use.
+
+kepler_dir = Path("visualisations/kepler")
+
+
+def dataset_file(data_id):
+    # 'Income and Population by NTA' -> income_and_population_by_nta.json
+    return re.sub(r'[^a-z0-9]+', '_', data_id.lower()).strip('_') + ".json"
+
+
+def write_datasets(datasets, kepler_dir=kepler_dir):
+    # datasets: {data id used in the map configs: DataFrame / GeoDataFrame}, each written once
+    # in the format KeplerGl itself sends to the browser
+    kepler_dir = Path(kepler_dir)
+    kepler_dir.mkdir(parents=True, exist_ok=True)
+    for data_id, data in datasets.items():
+        dataset = data_to_json({data_id: data}, None)[data_id]
+        with open(kepler_dir / dataset_file(data_id), "w", encoding="utf-8") as f:
+            json.dump(dataset, f, separators=(',', ':'))
+
+
+def write_view(name, config, kepler_dir=kepler_dir):
+    # config: KeplerGl.config of the map, as saved to the notebooks' config_*.json files
+    views_dir = Path(kepler_dir) / "views"
+    views_dir.mkdir(parents=True, exist_ok=True)
+    with open(views_dir / f"{name}.json", "w", encoding="utf-8") as f:
+        json.dump(config, f)
+
+
+def view_data_ids(config):
+    # datasets a config refers to, in layer order
+    vis_state = config['config']['visState']
+    data_ids = [layer['config']['dataId'] for layer in vis_state['layers']]
+    for item in vis_state.get('filters', []):
+        data_ids += item['dataId'] if isinstance(item['dataId'], list) else [item['dataId']]
+    return list(dict.fromkeys(data_ids))
+
+
+def _read_text(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def kepler_template():
+    # the page KeplerGl.save_to_html fills in, with the kepler.gl bundle inlined
+    return files('keplergl').joinpath('static/keplergl.html').read_text(encoding='utf-8')
+
+
+def map_html(view, kepler_dir=kepler_dir, read_only=False, read_text=_read_text, template=None):
+    # Same page as KeplerGl.save_to_html, with the dataset files pasted in as they are (no re-serialising).
+    # read_text / template let the dashboard pass in its cached file reads.
+    kepler_dir = Path(kepler_dir)
+    config_text = read_text(kepler_dir / "views" / f"{view}.json")
+    data = ",".join(
+        f"{json.dumps(data_id)}:{read_text(kepler_dir / dataset_file(data_id))}"
+        for data_id in view_data_ids(json.loads(config_text))
+    )
+    options = json.dumps({"readOnly": read_only, "centerMap": False})
+    cmd = f'window.__keplerglDataConfig = {{"config":{config_text},"data":{{{data}}},"options":{options}}};'
+
+    template = kepler_template() if template is None else template
+    k = template.find("<body>")
+    return template[:k] + "<body><script>" + cmd + "</script>" + template[k + 6:]
+
+
+def save_map_html(view, file_name, kepler_dir=kepler_dir, read_only=False):
+    # standalone export of a view, e.g. to open it outside the dashboard
+    with open(file_name, "w", encoding="utf-8") as f:
+        f.write(map_html(view, kepler_dir, read_only))
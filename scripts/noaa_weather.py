@@ -0,0 +1,198 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+import requests
+
+# Client for the NCEI (NOAA) Climate Data Online API used for the daily weather in loading_merging_data.ipynb.
+# Every page of results is cached on disk as JSON, keyed by its request parameters, so an interrupted
+# download resumes where it stopped and re-running the pipeline (for the same or more years) only requests
+# pages that aren't cached yet. Pages of ranges that ended less than SETTLE_DAYS before they were fetched are
+# not final (NOAA adds observations for a while afterwards), so they are requested again rather than read from
+# the cache. After the first page of a year gives the total count, the remaining pages are
+# fetched concurrently, spaced to stay under the API's limit of 5 requests per second; 429 and server
+# errors are retried with backoff.
+# The API only allows one year per request, so longer ranges are split into calendar years.
+# The result, wide_weather.csv, is the weather table of the pipeline: one row per day, joined to the trips
+# on date only after they have been aggregated per day (the trip data itself has no weather columns).
+
+API_URL = 'https://www.ncdc.noaa.gov/cdo-web/api/v2/data'
+cache_dir = Path(r"C:\Data\Citibike_NY_2022\noaa_cache")
+weather_path = Path(r"C:\Data\Citibike_NY_2022\wide_weather.csv")
+
+DATASET = 'GHCND'
+STATION = 'GHCND:USW00014732'  # LaGuardia Airport
+DATATYPES = ['TAVG', 'PRCP', 'AWND']
+WEATHER_NAMES = {'TAVG': 'temperature', 'PRCP': 'precipitation', 'AWND': 'wind'}
+PAGE_LIMIT = 1000  # the API maximum
+REQUESTS_PER_SECOND = 5
+WORKERS = 4
+MAX_RETRIES = 5
+TIMEOUT = 60  # seconds
+SETTLE_DAYS = 14  # days after which NOAA's data for a day doesn't change any more
+
+
+class RateLimiter:
+    # Spaces out calls from all threads to at most `per_second` per second
+    def __init__(self, per_second):
+        self.interval = 1 / per_second
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        time.sleep(max(0.0, start - now))
+
+
+def year_ranges(start, end):
+    # ('2021-03-01', '2022-12-31') -> [('2021-03-01', '2021-12-31'), ('2022-01-01', '2022-12-31')]
+    start, end = date.fromisoformat(str(start)), date.fromisoformat(str(end))
+    ranges = []
+    for year in range(start.year, end.year + 1):
+        ranges.append((max(start, date(year, 1, 1)).isoformat(), min(end, date(year, 12, 31)).isoformat()))
+    return ranges
+
+
+def settled(end, fetched):
+    # True if data up to `end` fetched on `fetched` is final
+    return date.fromisoformat(str(end)) + timedelta(days=SETTLE_DAYS) <= fetched
+
+
+def page_key(params):
+    # Cache file name for a page: hash of its parameters (the token is never part of params)
+    text = json.dumps(params, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+class WeatherClient:
+    def __init__(self, token, cache_dir=cache_dir, api_url=API_URL, workers=WORKERS,
+                 requests_per_second=REQUESTS_PER_SECOND, max_retries=MAX_RETRIES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.api_url = api_url
+        self.workers = workers
+        self.max_retries = max_retries
+        self.limiter = RateLimiter(requests_per_second)
+        self.session = requests.Session()
+        self.session.headers['token'] = token or ''
+        self.requested = 0  # pages actually requested from the API, i.e. not served from the cache
+        self.requested_lock = threading.Lock()  # pages are requested from several threads
+
+    def _request(self, params):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            try:
+                r = self.session.get(self.api_url, params=params, timeout=TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if r.ok:
+                    with self.requested_lock:
+                        self.requested += 1
+                    # an empty page comes back as {} rather than an empty result list
+                    return r.json() if r.content.strip() else {}
+                if (r.status_code != 429 and r.status_code < 500) or attempt == self.max_retries:
+                    r.raise_for_status()
+            time.sleep(min(2 ** attempt, 30))
+
+    def page(self, params):
+        # One page of results, from the cache if it was fetched after its range had settled
+        path = self.cache_dir / f"{page_key(params)}.json"
+        if path.exists() and settled(params['enddate'], date.fromtimestamp(path.stat().st_mtime)):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        data = self._request(params)
+        if not settled(params['enddate'], date.today()):
+            return data  # not final yet, so not cached
+        # Writing to a temp file first so an interrupted run never leaves a half page that looks complete
+        tmp = path.with_name(path.name + ".part")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+        return data
+
+    def fetch_year(self, start, end, station=STATION, datatypes=DATATYPES, dataset=DATASET):
+        # All records between start and end (within one year), in API order
+        params = {
+            'datasetid': dataset,
+            'datatypeid': list(datatypes),
+            'stationid': station,
+            'startdate': start,
+            'enddate': end,
+            'limit': PAGE_LIMIT,
+        }
+        first = self.page({**params, 'offset': 1})
+        count = first.get('metadata', {}).get('resultset', {}).get('count', 0)
+        offsets = range(1 + PAGE_LIMIT, count + 1, PAGE_LIMIT)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            rest = list(pool.map(lambda offset: self.page({**params, 'offset': offset}), offsets))
+        records = []
+        for data in [first] + rest:
+            records.extend(data.get('results', []))
+        return records
+
+    def fetch(self, start, end, station=STATION, datatypes=DATATYPES, dataset=DATASET):
+        records = []
+        for year_start, year_end in year_ranges(start, end):
+            year_records = self.fetch_year(year_start, year_end, station, datatypes, dataset)
+            print(f"{year_start} - {year_end}: {len(year_records):,} records")
+            records.extend(year_records)
+        return records
+
+
+def to_wide(records):
+    # API records (date, datatype, value, ...) -> one row per day with a column per datatype
+    d = pd.DataFrame(records, columns=['date', 'datatype', 'value'])
+    d['date'] = pd.to_datetime(d['date']).dt.date
+    wide_weather = d.pivot(index='date', columns='datatype', values='value').reset_index()
+    wide_weather.columns.name = None
+    return wide_weather
+
+
+def read_weather(path=weather_path):
+    # wide_weather.csv -> one row per day, date as datetime
+    return pd.read_csv(path, parse_dates=['date'])
+
+
+def daily_weather(trips, weather):
+    # Number of trips per day with that day's weather, named temperature / precipitation / wind
+    # (values as in the API data, so temperature is in tenths of °C)
+    daily = trips.groupby('date').size().rename('trip_count').reset_index()
+    daily['date'] = pd.to_datetime(daily['date'])
+    weather = weather.assign(date=pd.to_datetime(weather['date'])).rename(columns=WEATHER_NAMES)
+    return daily.merge(weather[['date', *WEATHER_NAMES.values()]], on='date', how='left')
+
+
+def fetch_weather(token, start, end, station=STATION, datatypes=DATATYPES, cache_dir=cache_dir):
+    client = WeatherClient(token, cache_dir)
+    wide_weather = to_wide(client.fetch(start, end, station, datatypes))
+    print(f"{len(wide_weather):,} days, {client.requested:,} pages requested from the API")
+    return wide_weather
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Download daily NOAA weather (cached) and save it one row per day")
+    parser.add_argument("--start", default="2022-01-01")
+    parser.add_argument("--end", default="2022-12-31")
+    parser.add_argument("--station", default=STATION)
+    parser.add_argument("--cache", type=Path, default=cache_dir)
+    parser.add_argument("--output", type=Path, default=weather_path)
+    args = parser.parse_args()
+
+    load_dotenv()  # NOAA_TOKEN from the .env file, as in loading_merging_data.ipynb
+    fetch_weather(os.environ.get('NOAA_TOKEN'), args.start, args.end, args.station, cache_dir=args.cache).to_csv(
+        args.output, index=False
+    )
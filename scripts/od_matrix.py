@@ -0,0 +1,178 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from routes import route_counts
+from stations import station_coordinates
+from trip_queries import TripStore
+
+# Origin-destination matrix: trips per (start station, end station) as a SciPy CSR matrix, with one station
+# table (key, lat, lng) whose row order is the matrix index on both axes.
+# routes.csv repeats both station names and coordinates on every route and each use of it regroups or
+# re-sorts the whole table; in the matrix a station's departures are a row sum, its arrivals a column sum,
+# round trips the diagonal and the busiest routes a partial sort of the stored counts - all O(nnz) -
+# and the coordinates are only joined onto the few routes that are returned.
+# The stations are sorted by key, so ties between routes with the same number of trips come out in
+# station order as in TripStore.route_counts.
+
+trips_path = Path(r"C:\Data\Citibike_NY_2022\merged\df_weather_duration.parquet")
+matrix_dir = Path(r"C:\Data\Citibike_NY_2022\merged\od_matrix")
+
+
+class ODMatrix:
+    def __init__(self, counts, stations, key='station_name'):
+        # counts: n x n sparse matrix of trips, stations: frame with key, lat and lng in matrix order
+        self.counts = sparse.csr_matrix(counts, dtype=np.int64)
+        self.counts.sum_duplicates()
+        self.counts.eliminate_zeros()
+        self.stations = stations.reset_index(drop=True)
+        self.key = key
+        self.index = pd.Index(self.stations[key])
+
+    @classmethod
+    def from_routes(cls, df_routes, stations=None, key='station_name'):
+        # From a long route table (routes.csv, TripStore.route_counts or routes.route_counts), repeated
+        # routes are added up. stations: frame with key, lat and lng; by default the coordinates of the
+        # route table are used (stations without them get NaN)
+        names = pd.Index(np.sort(pd.concat([df_routes[f'start_{key}'], df_routes[f'end_{key}']])
+                                 .dropna().astype(str).unique()))
+        if stations is None:
+            sides = [
+                df_routes.reindex(columns=[f'{side}_{key}', f'{side}_lat', f'{side}_lng'])
+                .set_axis([key, 'lat', 'lng'], axis=1)
+                for side in ['start', 'end']
+            ]
+            stations = pd.concat(sides).dropna(subset=[key])
+        coords = stations.assign(**{key: stations[key].astype(str)}).drop_duplicates(key).set_index(key)
+        table = coords[['lat', 'lng']].reindex(names).rename_axis(key).reset_index()
+
+        start = names.get_indexer(df_routes[f'start_{key}'].astype(str))
+        end = names.get_indexer(df_routes[f'end_{key}'].astype(str))
+        valid = (start >= 0) & (end >= 0)
+        counts = sparse.coo_matrix(
+            (df_routes['num_trips'].to_numpy(np.int64)[valid], (start[valid], end[valid])),
+            shape=(len(names), len(names)),
+        )
+        return cls(counts, table, key)
+
+    @classmethod
+    def from_trips(cls, trips_path=trips_path, key='station_name'):
+        # Counts the routes of a trip Parquet file or partitioned dataset folder with DuckDB
+        trips = TripStore(trips_path)
+        return cls.from_routes(trips.route_counts(key), trips.station_coordinates(key), key)
+
+    @classmethod
+    def from_frame(cls, trips, key='station_name'):
+        # From trips already loaded into pandas (e.g. a month read with read_trips), counted in memory
+        stations = station_coordinates(trips, key)
+        return cls.from_routes(route_counts(trips, stations, key), stations, key)
+
+    def save(self, directory=matrix_dir):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        sparse.save_npz(directory / "od_counts.npz", self.counts)
+        self.stations.to_csv(directory / "od_stations.csv", index=False)
+
+    @classmethod
+    def load(cls, directory=matrix_dir, key='station_name'):
+        directory = Path(directory)
+        stations = pd.read_csv(directory / "od_stations.csv", dtype={key: str}, keep_default_na=False,
+                               na_values={'lat': [''], 'lng': ['']})
+        return cls(sparse.load_npz(directory / "od_counts.npz"), stations, key)
+
+    def station(self, name):
+        # position of a station on both axes
+        return self.index.get_loc(name)
+
+    def total(self):
+        return int(self.counts.sum())
+
+    def departures(self):
+        # Trips starting at each station (row sums)
+        return pd.Series(np.asarray(self.counts.sum(axis=1)).ravel(), index=self.index, name='departures')
+
+    def arrivals(self):
+        # Trips ending at each station (column sums)
+        return pd.Series(np.asarray(self.counts.sum(axis=0)).ravel(), index=self.index, name='arrivals')
+
+    def round_trips(self):
+        # Trips ending at the station they started from, per station (the diagonal)
+        return pd.Series(self.counts.diagonal(), index=self.index, name='round_trips')
+
+    def round_trip_share(self):
+        # Percentage of trips that end at the station they started from
+        return self.counts.diagonal().sum() * 100 / self.total()
+
+    def _routes(self, positions):
+        # Route frame (start, end, num_trips, coordinates) for positions into the stored counts
+        coo_rows = np.repeat(np.arange(self.counts.shape[0]), np.diff(self.counts.indptr))
+        start, end = coo_rows[positions], self.counts.indices[positions]
+        coords = self.stations[['lat', 'lng']].to_numpy()
+        return pd.DataFrame({
+            f'start_{self.key}': self.index[start],
+            f'end_{self.key}': self.index[end],
+            'num_trips': self.counts.data[positions],
+            'start_lat': coords[start, 0],
+            'start_lng': coords[start, 1],
+            'end_lat': coords[end, 0],
+            'end_lng': coords[end, 1],
+        })
+
+    def top_routes(self, n=None):
+        # The n busiest routes (all routes with n=None) with coordinates, busiest first, ties in station order.
+        # CSR data is stored row by row with sorted columns, so its position is the station order
+        data = self.counts.data
+        positions = np.arange(len(data))
+        if n is not None and n < len(data):
+            # everything above the n-th largest count, then the first of the routes tied with it
+            nth = -np.partition(-data, n - 1)[n - 1]
+            tied = np.flatnonzero(data == nth)
+            positions = np.r_[np.flatnonzero(data > nth), tied[:n - (data > nth).sum()]]
+        positions = positions[np.lexsort((positions, -data[positions]))]
+        return self._routes(positions)
+
+    def round_trips_in_top(self, n=20):
+        # Number of the n busiest routes that start and end at the same station
+        top = self.top_routes(n)
+        return int((top[f'start_{self.key}'] == top[f'end_{self.key}']).sum())
+
+    def top_destinations(self, k=5):
+        # The k busiest destinations of every origin, with the rank within the origin (1 = busiest)
+        data = self.counts.data
+        rows = np.repeat(np.arange(self.counts.shape[0]), np.diff(self.counts.indptr))
+        order = np.lexsort((np.arange(len(data)), -data, rows))
+        rank = np.arange(len(order)) - self.counts.indptr[rows[order]]
+        positions = order[rank < k]
+        routes = self._routes(positions)
+        routes.insert(3, 'rank', rank[rank < k] + 1)
+        return routes
+
+    def outflow(self, values):
+        # Matrix-vector product: per origin, trips weighted by a value of their destination
+        # (e.g. share of trips ending in Manhattan with values = 1 for Manhattan stations)
+        return pd.Series(self.counts @ self._vector(values), index=self.index)
+
+    def inflow(self, values):
+        # Per destination, trips weighted by a value of their origin
+        return pd.Series(self.counts.T @ self._vector(values), index=self.index)
+
+    def _vector(self, values):
+        # array in matrix order; a Series is aligned on the station key, missing stations count 0
+        if isinstance(values, pd.Series):
+            return values.reindex(self.index, fill_value=0).to_numpy(dtype=float)
+        return np.asarray(values, dtype=float)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the origin-destination matrix of the trips")
+    parser.add_argument("--trips", type=Path, default=trips_path, help="trip Parquet file or partitioned dataset folder")
+    parser.add_argument("--output", type=Path, default=matrix_dir)
+    args = parser.parse_args()
+
+    od = ODMatrix.from_trips(args.trips)
+    od.save(args.output)
+    print(f"{len(od.index):,} stations, {od.counts.nnz:,} routes, {od.total():,} trips")
+    print(f"Round trips: {od.round_trip_share():.2f}% of trips, {od.round_trips_in_top(20)} of the top 20 routes")
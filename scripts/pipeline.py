@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dashboard_bundle import build_bundle
+from ingest_trips import BLOCK_SIZE, ingest_files
+from noaa_weather import STATION, fetch_weather
+from pipeline_config import config_path, load_config, source_zips, system_names, system_paths, system_settings
+from rollups import build_outputs, merge_trips
+from stations import normalize_stations
+from trip_schema import TRIP_SCHEMA, read_trips
+
+# One entry point for the whole pipeline, for any number of years and bike share systems (pipeline.json, e.g.
+# NYC 2019-2025 plus Jersey City), in place of running the notebooks a year at a time - which loads all the
+# year's trips into pandas and can't go past one year.
+# For each system the steps work on the month-partitioned trip dataset, one file at a time, so memory is
+# bounded by the size of a month (or DuckDB's memory limit) and not by the number of years:
+#   ingest    zips of the selected years -> merged/trips/month=YYYY-MM/*.parquet, one process per zip
+#   stations  canonical station ids and names (stations.py), month by month in order, extending the lookup table
+#   weather   daily NOAA weather over the years of the system's trips (cached per page, needs NOAA_TOKEN)
+#   rollups   new or changed months merged into the rollup store in parallel processes, then the dashboard CSVs
+#   bundle    the dashboard bundle from those CSVs
+# Every step skips what is already done, so re-running after adding a year only processes that year.
+# memory_gb in the config is shared between the parallel processes.
+
+STEPS = ['ingest', 'stations', 'weather', 'rollups', 'bundle']
+
+
+def parse_years(values):
+    # ['2019-2021', '2024'] -> [2019, 2020, 2021, 2024]
+    years = []
+    for value in values:
+        first, _, last = str(value).partition('-')
+        years.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(years))
+
+
+def _fingerprint(path):
+    stat = Path(path).stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def normalize_dataset(dataset_dir, lookup_dir):
+    # Rewrites every trip file of the dataset with canonical station ids/names, oldest month first so the
+    # lookup table is extended in time order. Files already normalized (normalized.json next to the lookup
+    # tables, outside the dataset so it can still be read as a whole) are skipped
+    manifest_path = Path(lookup_dir) / "normalized.json"
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    for path in sorted(Path(dataset_dir).rglob("*.parquet")):
+        key = path.relative_to(dataset_dir).as_posix()
+        if manifest.get(key) == _fingerprint(path):
+            continue
+        df = normalize_stations(read_trips(path), lookup_dir)
+        tmp = path.with_name(path.name + ".part")
+        table = pa.Table.from_pandas(df[TRIP_SCHEMA.names], schema=TRIP_SCHEMA, preserve_index=False)
+        pq.write_table(table, tmp, compression='zstd')
+        os.replace(tmp, path)
+        manifest[key] = _fingerprint(path)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest_path.write_text(json.dumps(manifest, indent=2))
+        print(f"Stations normalized in {key}")
+
+
+def dataset_years(dataset_dir):
+    # Years with at least one month partition in the dataset
+    return sorted({int(path.name[len("month="):][:4]) for path in Path(dataset_dir).glob("month=*")})
+
+
+def run_system(system, config, years=None, steps=STEPS, workers=None, memory_gb=None):
+    settings = system_settings(system, config)
+    paths = system_paths(system, config)
+    workers = workers or config.get('workers') or os.cpu_count()
+    memory_gb = memory_gb or config.get('memory_gb', 8)
+    memory_limit = f"{memory_gb / workers:.1f}GB"
+    timings = {}
+
+    for step in STEPS:
+        if step not in steps:
+            continue
+        start = time.perf_counter()
+        print(f"== {system}: {step}")
+        if step == 'ingest':
+            zips = [zip_file for files in source_zips(system, config, years).values() for zip_file in files]
+            # a parsed CSV block per process, with room for the conversion
+            block_size = min(BLOCK_SIZE, int(memory_gb * 1024 ** 3 / workers / 4))
+            total = ingest_files(zips, paths['trips'], workers, block_size)
+            print(f"{len(zips)} zips, {total:,} trips ingested")
+        elif step == 'stations':
+            normalize_dataset(paths['trips'], paths['station_lookup'])
+        elif step == 'weather':
+            token = os.environ.get('NOAA_TOKEN')
+            covered = dataset_years(paths['trips'])
+            if not token or not covered:
+                # without a weather table the rollups step builds df_weather.csv with empty weather columns
+                print("No NOAA_TOKEN or no trips yet, weather left as it is")
+            else:
+                weather = fetch_weather(token, f"{covered[0]}-01-01", f"{covered[-1]}-12-31",
+                                        settings.get('weather_station', STATION), cache_dir=paths['noaa_cache'])
+                weather.to_csv(paths['weather'], index=False)
+        elif step == 'rollups':
+            merge_trips(paths['trips'], paths['rollups'], workers=workers, memory_limit=memory_limit)
+            build_outputs(paths['rollups'], paths['outputs'], paths['weather'])
+        elif step == 'bundle':
+            scores = Path(settings.get('expansion_scores', paths['outputs'] / "expansion_scores.csv"))
+            build_bundle(paths['outputs'], paths['bundle'], scores)
+        timings[step] = time.perf_counter() - start
+    return timings
+
+
+def run_pipeline(config=None, systems=None, years=None, steps=STEPS, workers=None, memory_gb=None):
+    # Runs the steps for every system (all systems in the config by default), returns {system: {step: seconds}}
+    config = config or load_config()
+    return {
+        system: run_system(system, config, years, steps, workers, memory_gb)
+        for system in systems or system_names(config)
+    }
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Run the trip pipeline for the systems and years in pipeline.json")
+    parser.add_argument("--config", type=Path, default=config_path)
+    parser.add_argument("--systems", nargs="*", default=None, help="systems of the config to run (default: all)")
+    parser.add_argument("--years", nargs="*", default=None, help="years to ingest, e.g. 2019-2025 (default: the config's)")
+    parser.add_argument("--steps", nargs="*", default=STEPS, choices=STEPS)
+    parser.add_argument("--workers", type=int, default=None, help="parallel processes (default: config, else one per CPU)")
+    parser.add_argument("--memory-gb", type=float, default=None, help="memory shared by the processes (default: config)")
+    args = parser.parse_args()
+
+    load_dotenv()  # NOAA_TOKEN from the .env file, as in loading_merging_data.ipynb
+    years = parse_years(args.years) if args.years else None
+    report = run_pipeline(load_config(args.config), args.systems, years, args.steps, args.workers, args.memory_gb)
+    for system, timings in report.items():
+        print(f"{system}: " + ", ".join(f"{step} {seconds:.1f} s" for step, seconds in timings.items()))
@@ -0,0 +1,61 @@
+import json
+from pathlib import Path
+
+# Where each bike share system's data lives, read from pipeline.json at the top of the repo so the scripts,
+# notebooks and the local dashboard don't each hardwire C:/Data/Citibike_NY_2022.
+# Every system has a root folder; inside it the layout is fixed (LAYOUT, the layout the NYC 2022 data already
+# had) and only the raw trip zips are found per year, through the system's `source` folder and `zip_pattern`,
+# both of which can use {root} and {year}.
+
+config_path = Path(__file__).resolve().parent.parent / "pipeline.json"
+
+# path name -> location under the system's root
+LAYOUT = {
+    'trips': 'merged/trips',  # month-partitioned trip dataset (ingest_trips.py)
+    'trips_file': 'merged/df_weather_duration.parquet',  # single-file trips of loading_merging_data.ipynb
+    'station_lookup': 'merged/station_lookup',
+    'rollups': 'merged/rollups',
+    'outputs': 'merged',  # dashboard CSVs (rollups.py, build_dashboard_artifacts.py)
+    'bundle': 'merged/dashboard_bundle',
+    'weather': 'wide_weather.csv',
+    'noaa_cache': 'noaa_cache',
+    'images': 'Images',
+}
+
+
+def load_config(path=config_path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def system_names(config=None):
+    config = config or load_config()
+    return list(config['systems'])
+
+
+def system_settings(system=None, config=None):
+    # The system's entry of the config (the first system by default) with its root filled in
+    config = config or load_config()
+    system = system or system_names(config)[0]
+    if system not in config['systems']:
+        raise KeyError(f"No system '{system}' in the pipeline config, expected one of {system_names(config)}")
+    settings = dict(config['systems'][system])
+    settings['name'] = system
+    settings['root'] = settings.get('root', f"{config['data_root']}/{system}")
+    return settings
+
+
+def system_paths(system=None, config=None):
+    # {path name: Path} of LAYOUT for one system
+    root = Path(system_settings(system, config)['root'])
+    return {name: root / location for name, location in LAYOUT.items()}
+
+
+def source_zips(system=None, config=None, years=None):
+    # {year: sorted zip files} of the raw trip data, for the given years or the system's configured years
+    settings = system_settings(system, config)
+    zips = {}
+    for year in years or settings['years']:
+        source = Path(settings['source'].format(root=settings['root'], year=year))
+        zips[year] = sorted(source.glob(settings.get('zip_pattern', '*.zip').format(year=year)))
+    return zips
@@ -0,0 +1,360 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import duckdb
+
+from duration_stats import box_stats, duration_histogram_query
+from trip_schema import STATION_COLUMNS, TRIP_SCHEMA
+
+# Persistent rollup store, so adding a month of trips doesn't mean re-scanning the whole history.
+# Every trip file is aggregated once into a few small tables, written as month=YYYY-MM partitions:
+#   daily/         date -> trip_count, duration_sum
+#   station_days/  (date, station_name) -> departures, arrivals, duration sums
+#   route_months/  (month, start_station_name, end_station_name) -> num_trips, duration_sum
+#   duration_seconds/  (month, rideable_type, member_casual, seconds) -> num_trips, for the box plot statistics
+#   station_coords/  (month, station_name, lat, lng) -> trip ends, for each station's most common coordinates
+# (routes are kept per month rather than per day - per day there would be almost as many rows as trips)
+# Each trip file's rollups are kept in their own Parquet files (src_<id>_*.parquet) and merging a file
+# replaces them, so merging the same data twice gives the same store and a changed file is simply redone.
+# df_weather.csv, top_20.csv, routes.csv and station_summary.csv are then built from the rollups only,
+# df_weather.csv joining the daily weather table (wide_weather.csv) to the daily counts, and duration_box.csv
+# from the trips per duration second (duration_stats.py).
+# A trip file merged before a table was added to the store, or under other cleaning rules, is merged again
+# on the next run.
+# Trips are cleaned as in loading_merging_data.ipynb before they're aggregated (CLEAN_TRIPS): no missing values
+# ('' stations from files ingested before empty fields were read as null count as missing) and no negative
+# durations; station coordinates are the most common ones per station (station_coordinates view) rather than
+# each trip's own, as the notebook replaces them.
+
+trips_path = Path(r"C:\Data\Citibike_NY_2022\merged\df_weather_duration.parquet")
+rollup_dir = Path(r"C:\Data\Citibike_NY_2022\merged\rollups")
+output_dir = Path(r"C:\Data\Citibike_NY_2022\merged")
+weather_path = Path(r"C:\Data\Citibike_NY_2022\wide_weather.csv")
+
+CLEAN_TRIPS = " AND ".join(
+    [f"{field.name} IS NOT NULL" for field in TRIP_SCHEMA]
+    + [f"{col} <> ''" for col in STATION_COLUMNS]
+    + ["trip_duration >= 0"]
+)
+
+TABLES = ['daily', 'station_days', 'route_months', 'duration_seconds', 'station_coords']
+
+ROLLUP_QUERIES = {
+    'daily': """
+        SELECT
+            strftime(date, '%Y-%m') AS month,
+            CAST(date AS DATE) AS date,
+            COUNT(*) AS trip_count,
+            SUM(trip_duration) AS duration_sum
+        FROM trips
+        GROUP BY 1, 2
+    """,
+    'station_days': """
+        WITH deps AS (
+            SELECT CAST(date AS DATE) AS date, start_station_name AS station_name,
+                   COUNT(*) AS departures, SUM(trip_duration) AS departure_duration_sum
+            FROM trips
+            GROUP BY 1, 2
+        ), arrs AS (
+            SELECT CAST(date AS DATE) AS date, end_station_name AS station_name,
+                   COUNT(*) AS arrivals, SUM(trip_duration) AS arrival_duration_sum
+            FROM trips
+            GROUP BY 1, 2
+        )
+        SELECT
+            strftime(date, '%Y-%m') AS month,
+            date, station_name,
+            COALESCE(departures, 0) AS departures,
+            COALESCE(arrivals, 0) AS arrivals,
+            COALESCE(departure_duration_sum, 0) AS departure_duration_sum,
+            COALESCE(arrival_duration_sum, 0) AS arrival_duration_sum
+        FROM deps FULL OUTER JOIN arrs USING (date, station_name)
+    """,
+    'route_months': """
+        SELECT
+            strftime(date, '%Y-%m') AS month,
+            start_station_name,
+            end_station_name,
+            COUNT(*) AS num_trips,
+            SUM(trip_duration) AS duration_sum
+        FROM trips
+        GROUP BY ALL
+    """,
+    'duration_seconds': duration_histogram_query('trips', ["strftime(date, '%Y-%m') AS month"]),
+    # start and end coordinates counted together, as in stations.station_coordinates
+    'station_coords': """
+        SELECT strftime(date, '%Y-%m') AS month, station_name, lat, lng, COUNT(*) AS n
+        FROM (
+            SELECT date, start_station_name AS station_name, start_lat AS lat, start_lng AS lng FROM trips
+            UNION ALL
+            SELECT date, end_station_name, end_lat, end_lng FROM trips
+        )
+        WHERE station_name IS NOT NULL
+        GROUP BY ALL
+    """,
+}
+
+
+def _source_files(trips_path):
+    # A partitioned dataset folder is merged file by file, a single Parquet file as a whole
+    trips_path = Path(trips_path)
+    if trips_path.is_dir():
+        return sorted(trips_path.rglob("*.parquet"))
+    return [trips_path]
+
+
+def _fingerprint(path):
+    stat = Path(path).stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _load_manifest(rollup_dir):
+    path = Path(rollup_dir) / "manifest.json"
+    if path.exists():
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def _save_manifest(rollup_dir, manifest):
+    with open(Path(rollup_dir) / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _source_id(source):
+    return hashlib.md5(str(Path(source).resolve()).encode()).hexdigest()[:12]
+
+
+def merge_source(con, source, rollup_dir):
+    # Aggregates one trip file into the store, replacing its earlier rollups. Returns the months it covers
+    source_id = _source_id(source)
+    for old in Path(rollup_dir).glob(f"*/month=*/src_{source_id}_*.parquet"):
+        old.unlink()
+
+    con.execute(f"""
+        CREATE OR REPLACE VIEW trips AS
+        SELECT * FROM read_parquet('{Path(source).as_posix()}')
+        WHERE {CLEAN_TRIPS}
+    """)
+    for table, query in ROLLUP_QUERIES.items():
+        con.execute(f"""
+            COPY ({query})
+            TO '{(Path(rollup_dir) / table).as_posix()}'
+            (FORMAT PARQUET, PARTITION_BY (month), FILENAME_PATTERN 'src_{source_id}_{{i}}', OVERWRITE_OR_IGNORE)
+        """)
+    return [row[0] for row in con.execute(
+        "SELECT DISTINCT strftime(date, '%Y-%m') FROM trips ORDER BY 1"
+    ).fetchall()]
+
+
+def connect(memory_limit=None, threads=None, temp_dir=None):
+    # DuckDB connection, optionally capped in memory (spilling to temp_dir beyond it) and threads
+    config = {}
+    if memory_limit is not None:
+        config['memory_limit'] = memory_limit
+    if threads is not None:
+        config['threads'] = threads
+    if temp_dir is not None:
+        config['temp_directory'] = str(temp_dir)
+    return duckdb.connect(config=config)
+
+
+def _merge_in_process(source, rollup_dir, memory_limit=None, threads=None):
+    # merge_source on a connection of its own, for the worker processes of merge_trips
+    con = connect(memory_limit, threads, Path(rollup_dir) / ".tmp")
+    return merge_source(con, source, rollup_dir)
+
+
+def merge_trips(trips_path, rollup_dir, force=False, workers=1, memory_limit=None):
+    # Merges every trip file that is new or changed since the last merge into the rollup store.
+    # With workers > 1 the files are aggregated in parallel processes (every file writes its own rollup files),
+    # each DuckDB capped at memory_limit (e.g. '2GB') and sharing the CPUs
+    rollup_dir = Path(rollup_dir)
+    rollup_dir.mkdir(parents=True, exist_ok=True)
+    manifest = _load_manifest(rollup_dir)
+    pending = []
+    for source in _source_files(trips_path):
+        entry = manifest.get(str(Path(source).resolve()), {})
+        # files merged before a table was added to TABLES or with other cleaning rules are redone,
+        # so every table covers every file the same way
+        up_to_date = (entry.get('fingerprint') == _fingerprint(source) and set(TABLES) <= set(entry.get('tables', []))
+                      and entry.get('clean') == CLEAN_TRIPS)
+        if force or not up_to_date:
+            pending.append(source)
+
+    def record(source, months):
+        manifest[str(Path(source).resolve())] = {
+            'fingerprint': _fingerprint(source), 'months': months, 'tables': TABLES, 'clean': CLEAN_TRIPS,
+        }
+        _save_manifest(rollup_dir, manifest)
+        print(f"Merged {Path(source).name}: {', '.join(months)}")
+
+    if workers == 1 or len(pending) <= 1:
+        con = connect(memory_limit, temp_dir=rollup_dir / ".tmp")
+        for source in pending:
+            record(source, merge_source(con, source, rollup_dir))
+        return pending
+
+    threads = max(1, (os.cpu_count() or 1) // (workers or os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {source: pool.submit(_merge_in_process, source, rollup_dir, memory_limit, threads) for source in pending}
+        for source, future in futures.items():
+            record(source, future.result())
+    return pending
+
+
+def connect_rollups(rollup_dir, weather_path=weather_path):
+    # DuckDB connection with a view per table of the store, the most common coordinates of every station
+    # (each of lat and lng taken separately, smallest value on ties - as stations.station_coordinates) and
+    # the weather table (one row per day, create_weather_view)
+    con = duckdb.connect()
+    for table in TABLES:
+        # union_by_name: daily files merged before the weather moved out of the trips still have weather columns
+        con.execute(f"""
+            CREATE VIEW {table} AS
+            SELECT * FROM read_parquet('{(Path(rollup_dir) / table).as_posix()}/*/*.parquet',
+                                       hive_partitioning = true, hive_types_autocast = false, union_by_name = true)
+        """)
+    modes = {
+        col: f"""
+            SELECT station_name, FIRST({col} ORDER BY n DESC, {col}) AS {col}
+            FROM (SELECT station_name, {col}, SUM(n) AS n FROM station_coords WHERE NOT isnan({col}) GROUP BY ALL)
+            GROUP BY station_name
+        """
+        for col in ['lat', 'lng']
+    }
+    con.execute(f"""
+        CREATE VIEW station_coordinates AS
+        WITH lat AS ({modes['lat']}), lng AS ({modes['lng']})
+        SELECT station_name, lat, lng
+        FROM (SELECT DISTINCT station_name FROM station_coords) LEFT JOIN lat USING (station_name) LEFT JOIN lng USING (station_name)
+    """)
+    create_weather_view(con, weather_path)
+    return con
+
+
+def create_weather_view(con, weather_path=weather_path):
+    # `weather` view over the daily weather table; empty when there is no table (no NOAA_TOKEN yet),
+    # so df_weather.csv gets empty weather columns
+    if not Path(weather_path).exists():
+        print(f"No weather table at {weather_path}, df_weather.csv is built without weather")
+        con.execute("""
+            CREATE OR REPLACE VIEW weather AS
+            SELECT NULL::DATE AS date, NULL::DOUBLE AS TAVG, NULL::DOUBLE AS PRCP, NULL::DOUBLE AS AWND
+            WHERE false
+        """)
+        return
+    con.execute(f"""
+        CREATE OR REPLACE VIEW weather AS
+        SELECT * FROM read_csv('{Path(weather_path).as_posix()}', types = {{'date': 'DATE'}})
+    """)
+
+
+OUTPUT_QUERIES = {
+    # one row per day with number of trips and weather variables (temperature in °C)
+    'df_weather.csv': """
+        SELECT
+            d.date,
+            w.TAVG / 10 AS temperature,
+            w.PRCP AS precipitation,
+            w.AWND AS wind,
+            d.trip_count
+        FROM (
+            SELECT date, SUM(trip_count)::BIGINT AS trip_count
+            FROM daily
+            GROUP BY date  -- a day can be split over two trip files around month ends
+        ) d
+        LEFT JOIN weather w USING (date)
+        ORDER BY d.date
+    """,
+    # top 20 stations by number of trips beginning there
+    'top_20.csv': """
+        SELECT station_name AS start_station_name, SUM(departures)::BIGINT AS num_trips
+        FROM station_days
+        GROUP BY station_name
+        ORDER BY num_trips DESC
+        LIMIT 20
+    """,
+    # number of trips per route, with coordinates so it can be used for maps
+    'routes.csv': """
+        SELECT
+            CONCAT(start_station_name, '-', end_station_name) AS route,
+            r.num_trips,
+            start_station_name,
+            end_station_name,
+            s.lng AS start_lng,
+            s.lat AS start_lat,
+            e.lng AS end_lng,
+            e.lat AS end_lat
+        FROM (
+            SELECT start_station_name, end_station_name, SUM(num_trips)::BIGINT AS num_trips
+            FROM route_months
+            GROUP BY ALL
+        ) r
+        LEFT JOIN station_coordinates s ON s.station_name = r.start_station_name
+        LEFT JOIN station_coordinates e ON e.station_name = r.end_station_name
+        ORDER BY num_trips DESC, start_station_name, end_station_name
+    """,
+    # same columns as making_station_summary.ipynb, averaged over the days in the store
+    'station_summary.csv': """
+        WITH totals AS (
+            SELECT station_name, SUM(departures) AS trips_from, SUM(arrivals) AS trips_to
+            FROM station_days
+            GROUP BY station_name
+        ), n_days AS (
+            SELECT COUNT(DISTINCT date) AS days FROM daily
+        )
+        SELECT
+            station_name,
+            lat,
+            lng,
+            ROUND((trips_from - trips_to) * 100 / NULLIF(trips_from, 0), 1) AS no_return_pc,
+            ROUND(trips_from / days, 1) AS daily_deps,
+            ROUND(trips_to / days, 1) AS daily_arrs
+        FROM totals
+        LEFT JOIN station_coordinates USING (station_name)
+        CROSS JOIN n_days
+        ORDER BY station_name
+    """,
+}
+
+
+def build_outputs(rollup_dir, output_dir, weather_path=weather_path):
+    # Writes the dashboard/map CSVs from the rollups, returns {filename: seconds}
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    con = connect_rollups(rollup_dir, weather_path)
+    builders = {filename: lambda query=query: con.execute(query).df() for filename, query in OUTPUT_QUERIES.items()}
+    # trip duration box plot statistics, from the trips per second summed over the months
+    builders['duration_box.csv'] = lambda: box_stats(con.execute("""
+        SELECT rideable_type, member_casual, seconds, SUM(num_trips)::BIGINT AS num_trips
+        FROM duration_seconds
+        GROUP BY ALL
+    """).df())
+    timings = {}
+    for filename, build in builders.items():
+        start = time.perf_counter()
+        build().to_csv(output_dir / filename, index=False)
+        timings[filename] = time.perf_counter() - start
+        print(f"{filename:<20} {timings[filename] * 1000:8.1f} ms")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge new trip data into the rollup store and rebuild the CSVs from it")
+    parser.add_argument("--trips", type=Path, default=trips_path, help="trip Parquet file or partitioned dataset folder")
+    parser.add_argument("--rollups", type=Path, default=rollup_dir)
+    parser.add_argument("--output", type=Path, default=output_dir)
+    parser.add_argument("--weather", type=Path, default=weather_path, help="daily weather table (wide_weather.csv)")
+    parser.add_argument("--force", action="store_true", help="re-merge files even if they haven't changed")
+    parser.add_argument("--workers", type=int, default=1, help="trip files merged in parallel processes")
+    parser.add_argument("--memory-limit", default=None, help="DuckDB memory limit per process, e.g. 2GB")
+    args = parser.parse_args()
+
+    merge_trips(args.trips, args.rollups, args.force, args.workers, args.memory_limit)
+    build_outputs(args.rollups, args.output, args.weather)
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from stations import station_coordinates
+
+# Route (start station -> end station) aggregation.
+# Station coordinates are canonical per station after loading_merging_data, so instead of taking the
+# mode of four coordinate columns for every route, routes are counted on the station codes and the
+# coordinates are joined afterwards from a station table (one row per station).
+# This is the in-memory path, for trips already loaded into pandas (ODMatrix.from_frame); trips on disk are
+# counted by DuckDB with TripStore.route_counts.
+
+DENSE_LIMIT = 2 ** 24  # up to ~4,000 stations the route counts fit in one dense bincount
+
+
+def _route_codes(trips, key):
+    # Start and end columns as codes into one shared set of station categories
+    stations = union_categoricals(
+        [pd.Categorical(trips[f'start_{key}']), pd.Categorical(trips[f'end_{key}'])]
+    )
+    codes = stations.codes.astype(np.int64)
+    n = len(trips)
+    return codes[:n], codes[n:], stations.categories
+
+
+def _count_pairs(start, end, n_stations):
+    # -> (route ids as start * n_stations + end, trip counts), only routes with at least one trip
+    valid = (start >= 0) & (end >= 0)
+    route = start[valid] * n_stations + end[valid]
+    if n_stations * n_stations <= DENSE_LIMIT:
+        counts = np.bincount(route, minlength=n_stations * n_stations)
+        routes = np.flatnonzero(counts)
+        return routes, counts[routes]
+    route_ids, routes = pd.factorize(route)
+    return routes, np.bincount(route_ids)
+
+
+def route_counts(trips, stations=None, key='station_name', top_k=None):
+    # Number of trips per route with start/end coordinates, most popular first.
+    # stations: frame with key, lat and lng columns (e.g. station_summary.csv); by default it is built
+    # from the trips with stations.station_coordinates.
+    # top_k: only return the k most popular routes, selected with argpartition instead of sorting every pair
+    start, end, categories = _route_codes(trips, key)
+    n_stations = len(categories)
+    routes, counts = _count_pairs(start, end, n_stations)
+
+    if top_k is not None and top_k < len(counts):
+        keep = np.argpartition(-counts, top_k - 1)[:top_k]
+        routes, counts = routes[keep], counts[keep]
+    # busiest first, ties in station order so the output is reproducible
+    order = np.lexsort((routes, -counts))
+    routes, counts = routes[order], counts[order]
+    start_idx, end_idx = np.divmod(routes, n_stations)
+
+    df_routes = pd.DataFrame({
+        f'start_{key}': categories[start_idx],
+        f'end_{key}': categories[end_idx],
+        'num_trips': counts,
+    })
+
+    if stations is None:
+        stations = station_coordinates(trips, key)
+    return add_route_coordinates(df_routes, stations, key)
+
+
+def add_route_coordinates(df_routes, stations, key='station_name'):
+    # Adds start/end lat and lng to route counts (e.g. from trip_queries.TripStore.route_counts)
+    # from a station table with key, lat and lng columns
+    coords = stations.drop_duplicates(key).set_index(key)[['lat', 'lng']]
+    for side in ['start', 'end']:
+        station_coords = coords.reindex(df_routes[f'{side}_{key}'])
+        df_routes[f'{side}_lat'] = station_coords['lat'].to_numpy()
+        df_routes[f'{side}_lng'] = station_coords['lng'].to_numpy()
+    return df_routes
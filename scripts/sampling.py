@@ -0,0 +1,174 @@
+import argparse
+from pathlib import Path
+
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Deterministic sample of trips (df_sample_100.csv for the dashboard's membership box plot) built in one
+# streaming pass, instead of sorting every trip under 100 mins by hash(ride_id, 1) to keep the first 100k.
+# Each trip gets DuckDB's hash(ride_id, seed), and per stratum (e.g. rideable_type x member_casual) only the
+# trips with the smallest hashes are kept - a bottom-k sample, which is a uniform random sample of the stratum
+# that comes out the same whatever order or batch size the data is read in. Once a stratum holds its quota,
+# its largest kept hash is the threshold a new trip has to beat, so after the first batches very few rows
+# are kept at all.
+# Without strata the result is exactly ORDER BY hash(ride_id, seed) LIMIT n, as in chart_data_queries.ipynb.
+# With strata and no quotas the sample is split equally between them (a stratum with fewer trips than its
+# share is taken whole and the rest shared by the others), so every box of the plot gets as many trips.
+
+trips_path = Path(r"C:\Data\Citibike_NY_2022\merged\df_weather_duration.parquet")
+output_path = Path(r"C:\Data\Citibike_NY_2022\merged\df_sample_100.csv")
+
+SAMPLE_SIZE = 100_000
+SAMPLE_MAX_DURATION = 100  # minutes, longer trips are left out of the sample as outliers
+SAMPLE_SEED = 1
+STRATA = ['rideable_type', 'member_casual']
+BATCH_SIZE = 2_000_000
+
+
+def allocate(available, sample_size):
+    # Equal share of sample_size per stratum, {stratum: trips available} -> {stratum: quota}.
+    # Strata smaller than their share are taken whole and what they leave is split between the others
+    quotas = {}
+    remaining = sample_size
+    for i, (stratum, n) in enumerate(sorted(available.items(), key=lambda item: item[1])):
+        quotas[stratum] = min(n, remaining // (len(available) - i))
+        remaining -= quotas[stratum]
+    return quotas
+
+
+class StratifiedSampler:
+    def __init__(self, sample_size=SAMPLE_SIZE, strata=(), quotas=None, seed=SAMPLE_SEED,
+                 max_duration=SAMPLE_MAX_DURATION):
+        # strata: columns to stratify by; quotas: {stratum: rows}, strata as tuples of their column values
+        # (e.g. ('electric_bike', 'casual')), strata left out are not sampled. Without quotas the sample
+        # is split equally, so up to sample_size rows per stratum are kept until the end
+        self.sample_size = sample_size
+        self.strata = list(strata)
+        self.quotas = None if quotas is None else {self._label(k): v for k, v in quotas.items()}
+        self.seed = seed
+        self.max_duration = max_duration
+        self.con = duckdb.connect()
+        self.labels = {}  # stratum -> code
+        self.thresholds = np.empty(0, dtype=np.uint64)  # per stratum code, largest hash that can still be kept
+        self.parts = []  # arrow tables of kept trips, with sample_hash and stratum columns
+        self.buffered = 0
+
+    def _label(self, key):
+        return tuple(key) if isinstance(key, (tuple, list)) else (key,)
+
+    def _cap(self, label):
+        if self.quotas is None:
+            return self.sample_size
+        return self.quotas.get(label, 0)
+
+    def _codes(self, table):
+        # stratum code per row, new strata get the next code
+        if not self.strata:
+            labels = [()]
+            codes = np.zeros(table.num_rows, dtype=np.int64)
+        else:
+            keys = pd.MultiIndex.from_arrays([table.column(col).to_pandas().astype(object) for col in self.strata])
+            codes, labels = keys.factorize()
+        for label in labels:
+            label = self._label(label)
+            if label not in self.labels:
+                self.labels[label] = len(self.labels)
+                limit = np.iinfo(np.uint64).max if self._cap(label) > 0 else 0
+                self.thresholds = np.append(self.thresholds, np.uint64(limit))
+        mapping = np.array([self.labels[self._label(label)] for label in labels], dtype=np.int64)
+        return mapping[codes]
+
+    def add(self, batch):
+        # Takes one batch (pyarrow RecordBatch or Table) of trips
+        self.con.register('batch', batch)
+        candidates = self.con.execute(f"""
+            SELECT *, hash(ride_id, {self.seed}) AS sample_hash
+            FROM batch
+            WHERE trip_duration < {self.max_duration}
+        """).arrow()
+        self.con.unregister('batch')
+        codes = self._codes(candidates)
+        hashes = candidates.column('sample_hash').to_numpy()
+        keep = hashes <= self.thresholds[codes]
+        if keep.any():
+            kept = candidates.filter(pa.array(keep)).append_column('stratum', pa.array(codes[keep]))
+            self.parts.append(kept)
+            self.buffered += kept.num_rows
+        # compacting once the buffer holds twice what can be kept, so it's sorted every few batches only
+        if self.buffered > 2 * sum(self._cap(label) for label in self.labels):
+            self._compact()
+
+    def _compact(self, caps=None):
+        # Keeps the smallest hashes of each stratum up to its cap and lowers the thresholds of full strata
+        if not self.parts:
+            return
+        table = pa.concat_tables(self.parts, promote_options='permissive')
+        if caps is None:
+            caps = {code: self._cap(label) for label, code in self.labels.items()}
+        cap = np.array([caps[code] for code in range(len(self.labels))], dtype=np.int64)
+        codes = table.column('stratum').to_numpy()
+        hashes = table.column('sample_hash').to_numpy()
+        order = np.lexsort((hashes, codes))
+        codes_sorted = codes[order]
+        # position of each row within its stratum, in hash order
+        starts = np.searchsorted(codes_sorted, codes_sorted, side='left')
+        rank = np.arange(len(order)) - starts
+        keep = order[rank < cap[codes_sorted]]
+        table = table.take(pa.array(keep))
+        self.parts = [table]
+        self.buffered = table.num_rows
+        kept_codes = codes[keep]
+        for code in np.unique(kept_codes):
+            if (kept_codes == code).sum() >= cap[code]:
+                self.thresholds[code] = hashes[keep][kept_codes == code].max()
+
+    def counts(self):
+        # Trips currently kept per stratum
+        self._compact()
+        if not self.parts:
+            return {}
+        kept = np.bincount(self.parts[0].column('stratum').to_numpy(), minlength=len(self.labels))
+        return {label: int(kept[code]) for label, code in self.labels.items()}
+
+    def result(self):
+        # The sample as a pandas frame, by stratum (in order of the strata columns) and hash
+        available = self.counts()
+        if self.quotas is None and self.strata:
+            quotas = allocate(available, self.sample_size)
+        else:
+            quotas = {label: min(n, self._cap(label)) for label, n in available.items()}
+        self._compact({self.labels[label]: n for label, n in quotas.items()})
+        if not self.parts:
+            return pd.DataFrame()
+        df = self.parts[0].to_pandas()
+        sort_columns = [*self.strata, 'sample_hash']
+        df = df.sort_values(sort_columns, kind='stable').reset_index(drop=True)
+        return df.drop(columns=['sample_hash', 'stratum'])
+
+
+def sample_trips(trips_path=trips_path, sample_size=SAMPLE_SIZE, strata=STRATA, quotas=None,
+                 seed=SAMPLE_SEED, batch_size=BATCH_SIZE):
+    # Sample of a trip Parquet file or partitioned dataset folder, read batch by batch
+    sampler = StratifiedSampler(sample_size, strata, quotas, seed)
+    dataset = ds.dataset(trips_path, format='parquet', partitioning='hive')
+    for batch in dataset.to_batches(batch_size=batch_size):
+        sampler.add(batch)
+    return sampler.result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw the stratified trip sample for the dashboard box plot")
+    parser.add_argument("--trips", type=Path, default=trips_path, help="trip Parquet file or partitioned dataset folder")
+    parser.add_argument("--output", type=Path, default=output_path)
+    parser.add_argument("--size", type=int, default=SAMPLE_SIZE)
+    parser.add_argument("--strata", nargs="*", default=STRATA, help="columns to stratify by, none for a plain sample")
+    args = parser.parse_args()
+
+    sample = sample_trips(args.trips, args.size, args.strata)
+    sample.to_csv(args.output, index=False)
+    if args.strata:
+        print(sample.groupby(args.strata, observed=True).size().rename('trips').to_string())
+    print(f"{len(sample):,} trips sampled")
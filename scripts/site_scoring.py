@@ -0,0 +1,140 @@
+import argparse
+import time
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+from spatial_join import METRES_PER_FOOT, NTA_COLUMNS, site_points
+
+# Scores candidate sites for new Citi Bike stations on a regular grid over the city, instead of drawing
+# expansion zones by hand in KeplerGL (Expansion_zones.png).
+# Every grid cell inside a residential NTA gets four components between 0 and 1:
+#   density     - population density of its NTA, as a percentile over the cells
+#   income      - 1 - income percentile, so lower-income neighbourhoods score higher
+#   station_gap - distance to the nearest existing Citi Bike station, capped at STATION_GAP_M
+#   subway_gap  - distance to the nearest subway station, capped at SUBWAY_GAP_M
+# and the score is their weighted sum (WEIGHTS). The grid is laid out directly in NY State Plane
+# (EPSG:2263, feet); NTAs are looked up block by block on the grid and distances with KD-trees.
+
+station_summary_path = Path("Data/station_summary.csv")
+nta_path = Path("Data/nta_pop_inc.geojson")
+subway_stations_path = Path("subway_stations.geojson")
+output_path = Path("Data/expansion_scores.csv")
+
+CELL_SIZE_M = 50
+STATION_GAP_M = 1000  # a cell this far from the network counts as fully unserved
+SUBWAY_GAP_M = 1000
+WEIGHTS = {'density': 0.4, 'income': 0.2, 'station_gap': 0.25, 'subway_gap': 0.15}
+TOP_N = 5000  # cells written out, best first
+
+
+def grid_centres(bounds, cell_size_m=CELL_SIZE_M, shape='hex'):
+    # (x, y) 2D arrays (rows of cells) of cell centres covering bounds (EPSG:2263). Hex cells are pointy-top
+    # with the given distance between neighbouring centres, so a hex grid has about 13% fewer cells than
+    # a square one
+    minx, miny, maxx, maxy = bounds
+    step = cell_size_m / METRES_PER_FOOT
+    if shape not in ('hex', 'square'):
+        raise ValueError(f"shape must be 'hex' or 'square', got {shape!r}")
+    row_step = step * np.sqrt(3) / 2 if shape == 'hex' else step
+    x, y = np.meshgrid(np.arange(minx, maxx, step), np.arange(miny, maxy, row_step))
+    if shape == 'hex':
+        x[1::2] += step / 2  # every other row shifted by half a cell
+    return x, y
+
+
+def grid_nta_lookup(x, y, ntas):
+    # Same result as spatial_join.nta_lookup for the cells of grid_centres, but uses the grid layout:
+    # each NTA is only tested against the block of cells inside its bounding box, with
+    # shapely.contains_xy on the raw coordinates (about 40x faster than querying a million points)
+    rows, cols = y[:, 0], x[0, :]
+    step = cols[1] - cols[0] if len(cols) > 1 else 0
+    geoms = np.asarray(ntas.geometry.values)
+    shapely.prepare(geoms)
+    result = np.full(x.shape, -1, dtype=np.int64)
+    for i, (geom, (minx, miny, maxx, maxy)) in enumerate(zip(geoms, shapely.bounds(geoms))):
+        r0, r1 = np.searchsorted(rows, miny, side='left'), np.searchsorted(rows, maxy, side='right')
+        # shifted hex rows start half a cell right of cols, so the block starts one cell earlier
+        c0, c1 = np.searchsorted(cols, minx - step, side='left'), np.searchsorted(cols, maxx, side='right')
+        block = result[r0:r1, c0:c1]
+        inside = shapely.contains_xy(geom, x[r0:r1, c0:c1], y[r0:r1, c0:c1])
+        block[inside & (block < 0)] = i
+    return result.ravel()
+
+
+def percentile_rank(values):
+    # 0 for the smallest value up to 1 for the largest, ties share a rank
+    return pd.Series(values).rank(pct=True, method='average').to_numpy()
+
+
+def nearest_distance(x, y, targets_xy):
+    # distance in metres from every (x, y) to the nearest target (all in EPSG:2263)
+    distance, _ = cKDTree(targets_xy).query(np.column_stack([x, y]), k=1)
+    return distance * METRES_PER_FOOT
+
+
+def score_grid(ntas, stations, subway_stations, cell_size_m=CELL_SIZE_M, shape='hex', weights=WEIGHTS):
+    # One row per grid cell inside a residential NTA with lat, lng, the NTA columns, the distances,
+    # the score components and the score, best first
+    ntas = ntas.to_crs(epsg=2263).reset_index(drop=True)
+    x, y = grid_centres(ntas.total_bounds, cell_size_m, shape)
+
+    nta_idx = grid_nta_lookup(x, y, ntas)
+    inside = nta_idx >= 0
+    x, y, nta_idx = x.ravel()[inside], y.ravel()[inside], nta_idx[inside]
+
+    cells = ntas[NTA_COLUMNS].iloc[nta_idx].reset_index(drop=True)
+    station_xy = shapely.get_coordinates(site_points(stations))
+    subway_xy = shapely.get_coordinates(subway_stations.to_crs(epsg=2263).geometry.values)
+    cells['station_dist_m'] = nearest_distance(x, y, station_xy).round(1)
+    cells['subway_dist_m'] = nearest_distance(x, y, subway_xy).round(1)
+
+    components = {
+        'density': percentile_rank(cells['pop_density']),
+        'income': 1 - percentile_rank(cells['median_hh_income']),
+        'station_gap': np.minimum(cells['station_dist_m'].to_numpy() / STATION_GAP_M, 1),
+        'subway_gap': np.minimum(cells['subway_dist_m'].to_numpy() / SUBWAY_GAP_M, 1),
+    }
+    score = np.zeros(len(cells))
+    for name, weight in weights.items():
+        cells[name] = components[name].round(3)
+        score += weight * components[name]
+    cells['score'] = (score / sum(weights.values())).round(4)
+
+    lng, lat = Transformer.from_crs(2263, 4326, always_xy=True).transform(x, y)
+    cells.insert(0, 'lat', lat.round(5))
+    cells.insert(1, 'lng', lng.round(5))
+    return cells.sort_values('score', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def score_sites(station_summary_path=station_summary_path, nta_path=nta_path,
+                subway_stations_path=subway_stations_path, cell_size_m=CELL_SIZE_M, shape='hex'):
+    return score_grid(
+        gpd.read_file(nta_path),
+        pd.read_csv(station_summary_path),
+        gpd.read_file(subway_stations_path),
+        cell_size_m,
+        shape,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a grid of candidate sites for new Citi Bike stations")
+    parser.add_argument("--stations", type=Path, default=station_summary_path)
+    parser.add_argument("--ntas", type=Path, default=nta_path)
+    parser.add_argument("--subway", type=Path, default=subway_stations_path)
+    parser.add_argument("--output", type=Path, default=output_path)
+    parser.add_argument("--cell-size", type=float, default=CELL_SIZE_M, help="distance between cell centres in metres")
+    parser.add_argument("--shape", choices=['hex', 'square'], default='hex')
+    parser.add_argument("--top", type=int, default=TOP_N, help="number of best cells to write, 0 for all")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    cells = score_sites(args.stations, args.ntas, args.subway, args.cell_size, args.shape)
+    print(f"Scored {len(cells):,} {args.shape} cells of {args.cell_size:g} m in {time.perf_counter() - start:.1f} s")
+    (cells.head(args.top) if args.top else cells).to_csv(args.output, index=False)
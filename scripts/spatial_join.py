@@ -0,0 +1,86 @@
+import argparse
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# Which NTA each site (Citi Bike station or candidate location) is in, with that NTA's population density
+# and income, and how far the site is from the nearest subway station.
+# Both lookups use shapely STR-trees over the NTA polygons / subway stations, queried with all sites at
+# once, so enriching the ~1,800 stations or thousands of candidate sites is one vectorised call each.
+# Distances are measured in NY State Plane (EPSG:2263, feet) and reported in metres.
+
+station_summary_path = Path("Data/station_summary.csv")
+nta_path = Path("Data/nta_pop_inc.geojson")
+subway_stations_path = Path("subway_stations.geojson")
+output_path = Path("Data/station_context.csv")
+
+NTA_COLUMNS = ['nta2020', 'ntaname', 'boroname', 'pop_density', 'median_hh_income']
+METRES_PER_FOOT = 0.3048
+
+
+def site_points(sites, lat='lat', lng='lng'):
+    # lat/lng columns -> points in EPSG:2263
+    points = gpd.GeoSeries(gpd.points_from_xy(sites[lng], sites[lat]), index=sites.index, crs=4326)
+    return np.asarray(points.to_crs(epsg=2263).values)
+
+
+def nta_lookup(points, ntas):
+    # Position in ntas of the polygon containing each point, -1 if it is in none of them
+    # (water, parks and the non-residential NTAs dropped in NY_pop_inc_prep.ipynb)
+    tree = shapely.STRtree(np.asarray(ntas.to_crs(epsg=2263).geometry.values))
+    point_idx, nta_idx = tree.query(points, predicate='intersects')
+    # a point exactly on a border matches both sides, keeping the first
+    first = np.unique(point_idx, return_index=True)[1]
+    result = np.full(len(points), -1, dtype=np.int64)
+    result[point_idx[first]] = nta_idx[first]
+    return result
+
+
+def nearest_subway(points, subway_stations):
+    # (position in subway_stations of the nearest station, distance in metres) for each point
+    tree = shapely.STRtree(np.asarray(subway_stations.to_crs(epsg=2263).geometry.values))
+    (point_idx, station_idx), distance = tree.query_nearest(points, return_distance=True, all_matches=False)
+    nearest = np.empty(len(points), dtype=np.int64)
+    nearest[point_idx] = station_idx
+    dist = np.empty(len(points))
+    dist[point_idx] = distance * METRES_PER_FOOT
+    return nearest, dist
+
+
+def enrich_sites(sites, ntas, subway_stations, lat='lat', lng='lng'):
+    # Copy of sites with the NTA columns, nearest_subway (stop name) and subway_dist_m added
+    points = site_points(sites, lat, lng)
+    result = sites.copy()
+
+    nta_idx = nta_lookup(points, ntas)
+    nta_values = ntas[NTA_COLUMNS].reset_index(drop=True).reindex(np.where(nta_idx >= 0, nta_idx, len(ntas)))
+    for col in NTA_COLUMNS:
+        result[col] = nta_values[col].to_numpy()
+
+    subway_idx, subway_dist = nearest_subway(points, subway_stations)
+    result['nearest_subway'] = subway_stations['stop_name'].to_numpy()[subway_idx]
+    result['subway_dist_m'] = subway_dist.round(1)
+    return result
+
+
+def station_context(station_summary_path=station_summary_path, nta_path=nta_path,
+                    subway_stations_path=subway_stations_path):
+    stations = pd.read_csv(station_summary_path)
+    return enrich_sites(stations, gpd.read_file(nta_path), gpd.read_file(subway_stations_path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add NTA, population density, income and nearest subway to every station")
+    parser.add_argument("--stations", type=Path, default=station_summary_path)
+    parser.add_argument("--ntas", type=Path, default=nta_path)
+    parser.add_argument("--subway", type=Path, default=subway_stations_path)
+    parser.add_argument("--output", type=Path, default=output_path)
+    args = parser.parse_args()
+
+    df = station_context(args.stations, args.ntas, args.subway)
+    df.to_csv(args.output, index=False)
+    print(f"{len(df):,} stations, {df['nta2020'].isna().sum():,} outside the residential NTAs, "
+          f"median distance to subway {df['subway_dist_m'].median():.0f} m")
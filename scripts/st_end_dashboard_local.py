@@ -11,6 +11,9 @@ from keplergl import KeplerGl
 from datetime import datetime as dt
 from numerize.numerize import numerize
 from PIL import Image
+from dashboard_data import LazyData, load_html, load_map, load_table
+from duration_stats import box_figure
+from pipeline_config import system_paths
 
 ########################### Initial settings for dashboard ####################################################
 
@@ -53,24 +56,18 @@ with col_next:
 page = pages[st.session_state.page_idx]
 
 ########################## Import data ###########################################################################################
-top_20 = pd.read_csv('C:/Data/Citibike_NY_2022/merged/top_20.csv', index_col=False)
-routes = pd.read_csv("C:/Data/Citibike_NY_2022/merged/routes.csv", index_col=False)
-df_sample_100 = pd.read_csv("C:/Data/Citibike_NY_2022/merged/df_sample_100.csv", index_col=False)
-df_weather = pd.read_csv("C:/Data/Citibike_NY_2022/merged/df_weather.csv", index_col = False)
-# Making sure date is datetime and df is sorted by date
-df_weather = df_weather.sort_values('date')
-df_weather['date'] = pd.to_datetime(df_weather['date'])
-
-df_dow = df_weather[['date', 'trip_count']].copy()
-df_dow['day_of_week'] = df_dow['date'].dt.day_name()
-
-  # Determine order of days (it was starting with Satruday)
-dow_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-
-# Get average daily trips to plot
-avg_trips = df_dow.groupby('day_of_week')['trip_count'].mean().reset_index()
-avg_trips['day_of_week'] = pd.Categorical(avg_trips['day_of_week'], categories=dow_order, ordered=True)
-avg_trips = avg_trips.sort_values('day_of_week')
+# Nothing is read here: each page takes the datasets it needs from `data`, which loads them on first
+# access, so e.g. the Intro page renders without touching any data.
+# The tables come from the dashboard bundle (dashboard_bundle.py), already sorted and aggregated, memory-mapped
+# once and cached across reruns and sessions (see dashboard_data.py)
+paths = system_paths('nyc')  # data folders of the system in pipeline.json
+bundle_dir = paths['bundle']  # built by dashboard_bundle.py
+data = LazyData({
+    'duration_box': lambda: load_table(bundle_dir, 'duration_box'),
+    'df_weather': lambda: load_table(bundle_dir, 'df_weather'),
+    'avg_trips': lambda: load_table(bundle_dir, 'avg_trips'),
+    'expansion_scores': lambda: load_table(bundle_dir, 'expansion_scores'),
+})
 
 
 ######################################### DEFINE THE PAGES #####################################################################
@@ -85,7 +82,7 @@ if page == "Intro page":
 
     with col1:
         try:
-          my_image = Image.open("C:/Data/Citibike_NY_2022/Images/vertical_bikes_redbrick.jpg")
+          my_image = Image.open(paths['images'] / "vertical_bikes_redbrick.jpg")
           st.image(my_image, use_container_width=True)
         except Exception as e:
           st.warning(f"Image could not be loaded: {e}")
@@ -107,6 +104,8 @@ if page == "Intro page":
 elif page == "When and how are people using Citibike?":
 
   st.title("When and how are people using Citibike?")
+  df_weather = data['df_weather']
+  avg_trips = data['avg_trips']
 
   # Line plot of daily trips annotated with seasonal averages
 
@@ -221,37 +220,38 @@ elif page == "When and how are people using Citibike?":
 elif page == "Membership and Vehicle Types":
     
   st.title("Membership and Vehicle Types")
-
+  # box statistics over all trips under 100 mins, precomputed by build_dashboard_artifacts.py / rollups.py
+  duration_box = data['duration_box']
+  if duration_box is None:
+    st.info("The trip duration statistics (duration_box) aren't in this dashboard's data bundle yet - "
+            "rebuild the bundle with dashboard_bundle.py once duration_box.csv has been made.")
+  else:
     # Define color mapping
-  custom_colors = {
-      'member': 'blue',
-      'casual': 'orange'
-  }
-
-  fig_members = px.box(
-      df_sample_100,
-      x='rideable_type',
-      y='trip_duration',
-      color='member_casual',
-      color_discrete_map=custom_colors,
-      points='outliers', 
-      title='Trip Duration by Ride Type and Membership',
-      hover_data=[],
-      labels={
-          "rideable_type": "Bike Type",
-          "trip_duration": "Trip Duration (mins)",
-          "member_casual": "Membership Type"
-      }
-  )
-  fig_members.update_traces(hoverinfo='skip', hovertemplate=None)
+    custom_colors = {
+        'member': 'blue',
+        'casual': 'orange'
+    }
+
+    fig_members = box_figure(
+        duration_box,
+        x='rideable_type',
+        color='member_casual',
+        color_discrete_map=custom_colors,
+        title='Trip Duration by Ride Type and Membership',
+        labels={
+            "rideable_type": "Bike Type",
+            "trip_duration": "Trip Duration (mins)",
+            "member_casual": "Membership Type"
+        }
+    )
+
+    st.plotly_chart(fig_members, use_container_width=True)
+    st.markdown("Regardless of ride type, we see on the box plots that members (blue) tend to have shorter trips "
+                "than casual users. This is likely due to members using the bikes for regular activities and errands, "
+                "while casual members use them for recreational activities and sightseeing that are longer durations. " \
+                "With casual members we see that their rides with classic bikes last longer than with electric bikes, "
+                "but with members there's virtually no difference - they're taking quick trips with either type of bike")
 
-  st.plotly_chart(fig_members, use_container_width=True)
-  st.markdown("Regardless of ride type, we see on the box plots that members (blue) tend to have shorter trips "
-              "than casual users. This is likely due to members using the bikes for regular activities and errands, "
-              "while casual members use them for recreational activities and sightseeing that are longer durations. " \
-              "With casual members we see that their rides with classic bikes last longer than with electric bikes, "
-              "but with members there's virtually no difference - they're taking quick trips with either type of bike")
-  
 
 ########### top 1000 trips visualisation ############################
 
@@ -265,9 +265,8 @@ elif page == "Most Popular Bike Routes":
 
     path_to_html = "visualisations/routes.html" 
 
-    # Read file and keep in variable
-    with open(path_to_html, 'r', encoding='utf-8') as f: 
-      html_data = f.read()
+    # Read once per process and kept in memory (see dashboard_data.py)
+    html_data = load_html(path_to_html)
 
     ## Show in webpage
     st.header("Top 1000 Citibike routes in New York 2022")
@@ -293,16 +292,16 @@ elif page == "Busiest stations":
 
   path_to_html = "visualisations/top100_stations.html" 
 
-  # Read file and keep in variable
-  with open(path_to_html, 'r', encoding='utf-8') as f: 
-      html_data = f.read()
+  # Read once per process and kept in memory (see dashboard_data.py)
+  html_data = load_html(path_to_html)
 
     ## Show in webpage
   st.header("100 Busiest Citibike Stations in New York 2022")
   st.components.v1.html(html_data,height=500)
   st.markdown("Perhaps unsurprisingly, the busiest stations are on Manhattan, in particular midtown and the lower half of Manhattan."
               "For operations, it's worth noting that of these busiest stations, none have departures and arrivals that are extremely out-of-balance - "
-              "no station sees more than a 5% difference between arrivals and departures")
+              "over the year as a whole, no station sees more than a 5% difference between arrivals and departures. "
+              "That is a yearly balance though: within a day a station can still run empty in the morning and fill up in the evening.")
 
 
 ################## Expansions condsiderations layered maps ###########################
@@ -314,7 +313,7 @@ elif page == "Expansion Considerations: Population, Income and Subway Network":
   choice = st.selectbox("Choose map background:", ["Population Density", "Income"])
 
   if choice == "Population Density":
-        html_file = "visualisations/stops_layers_pop.html"
+        map_view = "stops_layers_pop"
         map_notes = """
         **Map Notes**
         - This map shows population density by NTA region.
@@ -324,7 +323,7 @@ elif page == "Expansion Considerations: Population, Income and Subway Network":
         """
 
   else:
-        html_file = "visualisations/stops_layers_inc.html"
+        map_view = "stops_layers_inc"
         map_notes = """
         **Map Notes**
         - This map shows median household income by NTA region.
@@ -336,9 +335,9 @@ elif page == "Expansion Considerations: Population, Income and Subway Network":
   col1, col2 = st.columns([3, 1])  
 
   with col1:
-      # Display html map
-      with open(html_file, "r", encoding="utf-8") as f:
-          html_content = f.read()
+      # Display html map. Both views are configs over the same dataset files (see kepler_maps.py),
+      # which stay cached, so switching between them doesn't re-read anything
+      html_content = load_map(map_view)
       st.components.v1.html(html_content, height=500)
 
   with col2:
@@ -492,9 +491,29 @@ else:
       </div>
       """, unsafe_allow_html=True)
 
-  zones = Image.open("C:/Data/Citibike_NY_2022/Images/Expansion_zones.png")  #source: KeplerGL
+  zones = Image.open(paths['images'] / "Expansion_zones.png")  #source: KeplerGL
   st.image(zones, use_container_width=True)
 
+  # Best scoring grid cells from site_scoring.py (population density, income, distance to stations and subway)
+  expansion_scores = data['expansion_scores']
+  if expansion_scores is None:
+    st.info("The candidate site scores (expansion_scores) aren't in this dashboard's data bundle yet - "
+            "rebuild the bundle with dashboard_bundle.py once site_scoring.py has written expansion_scores.csv.")
+  else:
+    fig_sites = px.scatter_map(
+        expansion_scores,
+        lat='lat',
+        lon='lng',
+        color='score',
+        color_continuous_scale='Viridis',
+        hover_name='ntaname',
+        hover_data={'station_dist_m': True, 'subway_dist_m': True, 'lat': False, 'lng': False},
+        zoom=9.5,
+        height=500,
+        title='Highest scoring candidate sites for new stations',
+    )
+    st.plotly_chart(fig_sites, use_container_width=True)
+
 # --- Navigation buttons at the bottom ---
 col_prev_btm, col_next_btm = st.columns([1, 1])
 with col_prev_btm:
@@ -0,0 +1,203 @@
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Station canonicalisation.
+# The raw trip files have several spellings of some station names per id (typos, leading spaces, suffixes)
+# and several ids per name ('1.1' vs '1.10'). The lookup table resolves every raw station id to one
+# canonical (station_id, station_name) pair:
+#   1. each raw id gets its most common name (counting start and end columns together)
+#   2. each of those names gets the raw id with the most trips
+# Ties go to the alphabetically first value so the result is reproducible.
+
+SIDES = ['start', 'end']
+LOOKUP_COLUMNS = ['raw_id', 'station_id', 'station_name', 'trips']
+LOOKUP_PATTERN = re.compile(r"station_lookup_v(\d+)\.csv$")
+
+
+def station_pair_counts(df):
+    # Number of trip ends per (raw id, raw name) pair, start and end columns combined
+    counts = [
+        df.groupby([f'{side}_station_id', f'{side}_station_name'], observed=True).size()
+        .rename_axis(['raw_id', 'raw_name'])
+        for side in SIDES
+    ]
+    counts = pd.concat(counts).reset_index(name='trips')
+    counts[['raw_id', 'raw_name']] = counts[['raw_id', 'raw_name']].astype(str)
+    # missing ids/names (null, or '' in files from before ingestion read them as null) are not stations
+    counts = counts[(counts['raw_id'].str.strip() != '') & (counts['raw_name'].str.strip() != '')]
+    return counts.groupby(['raw_id', 'raw_name'], as_index=False)['trips'].sum()
+
+
+def _resolve(counts, existing_names=None):
+    # counts: raw_id, raw_name, trips -> lookup table with one row per raw id
+    top_names = (
+        counts.sort_values(['raw_id', 'trips', 'raw_name'], ascending=[True, False, True])
+        .drop_duplicates('raw_id')
+    )
+    table = pd.DataFrame({
+        'raw_id': top_names['raw_id'].to_numpy(),
+        'station_name': top_names['raw_name'].to_numpy(),
+        'trips': counts.groupby('raw_id')['trips'].sum().loc[top_names['raw_id']].to_numpy(),
+    })
+    best_ids = (
+        table.sort_values(['station_name', 'trips', 'raw_id'], ascending=[True, False, True])
+        .drop_duplicates('station_name')
+        .set_index('station_name')['raw_id']
+    )
+    if existing_names is not None:
+        # names that are already in the table keep their canonical id
+        best_ids = pd.concat([existing_names, best_ids[~best_ids.index.isin(existing_names.index)]])
+    table['station_id'] = table['station_name'].map(best_ids)
+    return table[LOOKUP_COLUMNS]
+
+
+def build_station_table(df):
+    # Lookup table from a trip frame with start/end station id and name columns
+    return _resolve(station_pair_counts(df))
+
+
+def extend_station_table(table, df):
+    # Adds raw ids from df that the table doesn't know yet, leaving existing rows untouched,
+    # so a new month can be normalised without recounting the whole history
+    counts = station_pair_counts(df)
+    new_counts = counts[~counts['raw_id'].isin(table['raw_id'])]
+    if new_counts.empty:
+        return table
+    existing_names = table.drop_duplicates('station_name').set_index('station_name')['station_id']
+    new_rows = _resolve(new_counts, existing_names)
+    return pd.concat([table, new_rows], ignore_index=True)
+
+
+def apply_station_table(df, table):
+    # Replaces the start/end station id and name columns with their canonical values (in place, returns df).
+    # Works on the category codes: each raw id category is looked up once, then the row codes are remapped
+    # with a single take, so all four columns end up sharing the same categories.
+    # Raw ids missing from the table become NaN - use extend_station_table first for new data
+    id_categories = pd.Index(np.sort(table['station_id'].unique()))
+    name_categories = pd.Index(np.sort(table['station_name'].unique()))
+    table_ids = pd.Index(table['raw_id'])
+    id_codes = id_categories.get_indexer(table['station_id'])
+    name_codes = name_categories.get_indexer(table['station_name'])
+
+    for side in SIDES:
+        raw = df[f'{side}_station_id']
+        if not isinstance(raw.dtype, pd.CategoricalDtype):
+            raw = raw.astype('category')
+        pos = table_ids.get_indexer(raw.cat.categories.astype(str))
+        codes = raw.cat.codes.to_numpy()
+        valid = (codes >= 0) & (pos[codes] >= 0)
+        row_pos = np.where(valid, pos[codes], 0)
+        new_id_codes = np.where(valid, id_codes[row_pos], -1)
+        new_name_codes = np.where(valid, name_codes[row_pos], -1)
+        df[f'{side}_station_id'] = pd.Categorical.from_codes(new_id_codes, categories=id_categories)
+        df[f'{side}_station_name'] = pd.Categorical.from_codes(new_name_codes, categories=name_categories)
+    return df
+
+
+def _lookup_versions(directory):
+    versions = {}
+    for path in Path(directory).glob("station_lookup_v*.csv"):
+        match = LOOKUP_PATTERN.search(path.name)
+        if match:
+            versions[int(match.group(1))] = path
+    return versions
+
+
+def save_station_table(table, directory):
+    # Writes the table as the next version (station_lookup_v001.csv, v002, ...), returns the path
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    version = max(_lookup_versions(directory), default=0) + 1
+    path = directory / f"station_lookup_v{version:03d}.csv"
+    table[LOOKUP_COLUMNS].to_csv(path, index=False)
+    return path
+
+
+def load_station_table(directory, version=None):
+    # Latest version by default, None if nothing has been saved yet
+    versions = _lookup_versions(directory)
+    if not versions:
+        return None
+    path = versions[version if version is not None else max(versions)]
+    # keep_default_na=False: ids and names like 'NA' stay strings
+    return pd.read_csv(path, dtype={'raw_id': str, 'station_id': str, 'station_name': str, 'trips': 'int64'},
+                       keep_default_na=False)
+
+
+def normalize_stations(df, directory):
+    # Loads the latest lookup table, adds any new raw ids from df (saving a new version if there were any)
+    # and applies it to df
+    table = load_station_table(directory)
+    if table is None:
+        table = build_station_table(df)
+        save_station_table(table, directory)
+    else:
+        extended = extend_station_table(table, df)
+        if len(extended) > len(table):
+            save_station_table(extended, directory)
+        table = extended
+    return apply_station_table(df, table)
+
+
+def _modal_by_code(codes, values, n_keys):
+    # Most common value per key code (codes: int array, -1 = missing key) -> float array of length n_keys.
+    # Every (key, value) pair is packed into one int64 so counting is a single factorize + bincount
+    # (float32 coordinates are packed by their bit pattern, other dtypes via factorized value codes).
+    # The pairs - far fewer than rows - are then sorted by key, count descending and value, and the first
+    # pair per key is kept. On ties that is the smallest value, which is what Series.mode().iloc[0] returns
+    keep = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[keep].astype(np.int64), values[keep]
+    result = np.full(n_keys, np.nan)
+    if len(values) == 0:
+        return result
+    if values.dtype == np.float32:
+        pair_ids, pairs = pd.factorize((codes << 32) | values.view(np.uint32).astype(np.int64))
+        pair_key = pairs >> 32
+        pair_value = (pairs & 0xFFFFFFFF).astype(np.uint32).view(np.float32)
+    else:
+        value_codes, uniques = pd.factorize(values)
+        pair_ids, pairs = pd.factorize(codes * len(uniques) + value_codes)
+        pair_key, pair_value = pairs // len(uniques), uniques[pairs % len(uniques)]
+    counts = np.bincount(pair_ids)
+    order = np.lexsort((pair_value, -counts, pair_key))
+    first = order[np.r_[True, pair_key[order][1:] != pair_key[order][:-1]]]
+    result[pair_key[first]] = pair_value[first]
+    return result
+
+
+def _modal_frame(keys, values_by_column, key):
+    # keys: Categorical with one entry per trip end, values_by_column: {column: array aligned with keys}
+    codes = keys.codes
+    n_keys = len(keys.categories)
+    modes = pd.DataFrame(
+        {col: _modal_by_code(codes, np.asarray(values), n_keys) for col, values in values_by_column.items()},
+        index=pd.Index(keys.categories, name=key),
+    )
+    observed = np.bincount(codes[codes >= 0], minlength=n_keys) > 0
+    modes = modes[observed].sort_index().reset_index()
+    # keep the coordinate dtype (float32 in the trip schema)
+    return modes.astype({col: np.asarray(values).dtype for col, values in values_by_column.items()})
+
+
+def modal_coordinates(df, key='station_id', columns=('lat', 'lng')):
+    # Most common value of each coordinate column per key, from a long frame with one row per trip end.
+    # Same result as groupby(key)[columns].agg(lambda x: x.mode().iloc[0] if not x.mode().empty else x.iloc[0])
+    # - each column's mode is taken separately - without calling mode() once per group
+    keys = pd.Categorical(df[key])
+    return _modal_frame(keys, {col: df[col].to_numpy() for col in columns}, key)
+
+
+def station_coordinates(trips, key='station_id'):
+    # Modal lat/lng per station straight from a trip frame, counting start and end coordinates together
+    # (only the key codes and coordinate arrays get stacked, not a renamed copy of the frame).
+    # key is 'station_id' or 'station_name'
+    keys = union_categoricals([pd.Categorical(trips[f'{side}_{key}']) for side in SIDES])
+    values = {
+        col: np.concatenate([trips[f'{side}_{col}'].to_numpy() for side in SIDES])
+        for col in ['lat', 'lng']
+    }
+    return _modal_frame(keys, values, key)
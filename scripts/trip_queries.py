@@ -0,0 +1,207 @@
+import argparse
+from datetime import date, timedelta
+from pathlib import Path
+
+import duckdb
+import numpy as np
+from scipy.stats import gaussian_kde
+
+from noaa_weather import WEATHER_NAMES
+
+# Trip aggregates for the analysis notebooks computed by DuckDB straight from the Parquet data, so the
+# notebooks get back small frames (one row per station, route, day or duration bin) instead of loading
+# all ~30M trips into pandas and grouping them there.
+# The source is the single trip file or the month=YYYY-MM dataset written by ingest_trips.py. DuckDB only
+# reads the columns a query uses, and a date range restricts the scan to the months in it (partition
+# pruning on the dataset folders, row-group statistics within a file). Aggregation runs out of core,
+# spilling to disk past memory_limit.
+# Every query goes through the `trips` view, which already has the date range applied, so TripStore.query
+# can be used for anything the methods below don't cover.
+
+trips_path = Path(r"C:\Data\Citibike_NY_2022\merged\df_weather_duration.parquet")
+
+SIDES = ['start', 'end']
+
+
+def _parquet_source(path):
+    # read_parquet(...) over a single file or a hive-partitioned dataset folder -> (SQL, partitioned)
+    path = Path(path)
+    if path.is_dir():
+        return (f"read_parquet('{path.as_posix()}/**/*.parquet', hive_partitioning = true, "
+                f"hive_types_autocast = false, union_by_name = true)"), True
+    return f"read_parquet('{path.as_posix()}')", False
+
+
+def _date_filter(start, end, partitioned):
+    # WHERE clause for an inclusive date range; on a dataset the month condition prunes whole partitions
+    conditions = []
+    if start is not None:
+        start = date.fromisoformat(str(start))
+        conditions.append(f"date >= DATE '{start}'")
+        if partitioned:
+            conditions.append(f"month >= '{start:%Y-%m}'")
+    if end is not None:
+        end = date.fromisoformat(str(end))
+        conditions.append(f"date < DATE '{end + timedelta(days=1)}'")
+        if partitioned:
+            conditions.append(f"month <= '{end:%Y-%m}'")
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+class TripStore:
+    def __init__(self, path=trips_path, start=None, end=None, memory_limit=None, threads=None):
+        # start, end: optional inclusive date range ('2022-06-01'), memory_limit e.g. '4GB'
+        config = {}
+        if memory_limit is not None:
+            config['memory_limit'] = memory_limit
+        if threads is not None:
+            config['threads'] = threads
+        self.con = duckdb.connect(config=config)
+        source, partitioned = _parquet_source(path)
+        self.con.execute(f"CREATE VIEW trips AS SELECT * FROM {source} {_date_filter(start, end, partitioned)}")
+
+    def query(self, sql, params=None):
+        # Any SQL over the `trips` view -> pandas frame
+        return self.con.execute(sql, params).df()
+
+    def count(self):
+        return self.con.execute("SELECT COUNT(*) FROM trips").fetchone()[0]
+
+    def category_counts(self, column):
+        # Number of trips per value of column (e.g. member_casual), most common first
+        return self.query(f"""
+            SELECT {column}, COUNT(*) AS num_trips
+            FROM trips
+            GROUP BY 1
+            ORDER BY num_trips DESC, 1
+        """)
+
+    def station_counts(self, side='start', key='station_name', top_k=None):
+        # Number of trips starting (side='start') or ending at each station, busiest first
+        limit = f"LIMIT {int(top_k)}" if top_k is not None else ""
+        return self.query(f"""
+            SELECT {side}_{key}, COUNT(*) AS num_trips
+            FROM trips
+            WHERE {side}_{key} IS NOT NULL
+            GROUP BY 1
+            ORDER BY num_trips DESC, 1
+            {limit}
+        """)
+
+    def station_activity(self, key='station_name'):
+        # One row per station with trips_from (departures) and trips_to (arrivals), 0 where there are none
+        return self.query(f"""
+            WITH deps AS (
+                SELECT start_{key} AS {key}, COUNT(*) AS trips_from FROM trips WHERE start_{key} IS NOT NULL GROUP BY 1
+            ), arrs AS (
+                SELECT end_{key} AS {key}, COUNT(*) AS trips_to FROM trips WHERE end_{key} IS NOT NULL GROUP BY 1
+            )
+            SELECT {key}, COALESCE(trips_from, 0) AS trips_from, COALESCE(trips_to, 0) AS trips_to
+            FROM deps FULL OUTER JOIN arrs USING ({key})
+            ORDER BY {key}
+        """)
+
+    def station_coordinates(self, key='station_name'):
+        # Same result as stations.station_coordinates: most common lat and lng (each taken separately,
+        # smallest value on ties) per station, counting start and end coordinates together
+        ends = " UNION ALL ".join(
+            f"SELECT {side}_{key} AS {key}, {side}_lat AS lat, {side}_lng AS lng FROM trips WHERE {side}_{key} IS NOT NULL"
+            for side in SIDES
+        )
+        modes = {
+            col: f"""
+                SELECT {key}, FIRST({col} ORDER BY n DESC, {col}) AS {col}
+                FROM (SELECT {key}, {col}, COUNT(*) AS n FROM ends WHERE NOT isnan({col}) GROUP BY ALL)
+                GROUP BY {key}
+            """
+            for col in ['lat', 'lng']
+        }
+        return self.query(f"""
+            WITH ends AS ({ends}),
+            keys AS (SELECT DISTINCT {key} FROM ends),
+            lat AS ({modes['lat']}),
+            lng AS ({modes['lng']})
+            SELECT {key}, lat, lng
+            FROM keys LEFT JOIN lat USING ({key}) LEFT JOIN lng USING ({key})
+            ORDER BY {key}
+        """)
+
+    def route_counts(self, key='station_name', top_k=None):
+        # Number of trips per (start, end) station pair, busiest first (ties by station names).
+        # ODMatrix.from_routes / top_routes add the station coordinates for mapping
+        limit = f"LIMIT {int(top_k)}" if top_k is not None else ""
+        return self.query(f"""
+            SELECT start_{key}, end_{key}, COUNT(*) AS num_trips
+            FROM trips
+            WHERE start_{key} IS NOT NULL AND end_{key} IS NOT NULL
+            GROUP BY ALL
+            ORDER BY num_trips DESC, 1, 2
+            {limit}
+        """)
+
+    def daily(self, weather_path=None):
+        # Number of trips per day; with weather_path, that day's weather from wide_weather.csv joined after
+        # counting, named as in noaa_weather.daily_weather (temperature in tenths of °C)
+        counts = "SELECT CAST(date AS DATE) AS date, COUNT(*) AS trip_count FROM trips GROUP BY 1"
+        if weather_path is None:
+            df = self.query(f"{counts} ORDER BY date")
+        else:
+            weather_columns = ", ".join(f"w.{code} AS {name}" for code, name in WEATHER_NAMES.items())
+            df = self.query(f"""
+                SELECT t.date, t.trip_count, {weather_columns}
+                FROM ({counts}) t
+                LEFT JOIN read_csv('{Path(weather_path).as_posix()}', types = {{'date': 'DATE'}}) w USING (date)
+                ORDER BY t.date
+            """)
+        df['date'] = df['date'].astype('datetime64[ns]')
+        return df
+
+    def duration_histogram(self, bin_width=1, max_duration=None, by=()):
+        # Number of trips per trip_duration bin (minutes, bins [bin_start, bin_start + bin_width)) and
+        # per group of the `by` columns; negative durations and those of max_duration or more are left out
+        by = list(by)
+        conditions = ["trip_duration >= 0"]
+        if max_duration is not None:
+            conditions.append(f"trip_duration < {float(max_duration)}")
+        groups = "".join(f"{col}, " for col in by)
+        return self.query(f"""
+            SELECT {groups}FLOOR(trip_duration / {float(bin_width)}) * {float(bin_width)} AS bin_start,
+                   COUNT(*) AS num_trips
+            FROM trips
+            WHERE {' AND '.join(conditions)}
+            GROUP BY ALL
+            ORDER BY ALL
+        """)
+
+    def duration_quantiles(self, quantiles=(0.25, 0.5, 0.75), max_duration=None, by=()):
+        # Exact trip_duration quantiles (interpolated as pandas' quantile does) per group of the `by` columns,
+        # one column per quantile named q25, q50, ...
+        by = list(by)
+        where = f"WHERE trip_duration < {float(max_duration)}" if max_duration is not None else ""
+        columns = ", ".join(f"quantile_cont(trip_duration, {float(q)}) AS q{round(q * 100):g}" for q in quantiles)
+        groups = ", ".join(by)
+        return self.query(f"""
+            SELECT {groups + ', ' if by else ''}COUNT(*) AS num_trips, {columns}
+            FROM trips
+            {where}
+            {'GROUP BY ' + groups + ' ORDER BY ' + groups if by else ''}
+        """)
+
+
+def histogram_kde(histogram, x, value='bin_start', weight='num_trips', bin_width=1):
+    # Gaussian KDE of the durations evaluated at x, estimated from the bin centres weighted by their counts
+    # (the bins are narrow, so this is close to fitting the KDE on every trip)
+    centres = histogram[value].to_numpy() + bin_width / 2
+    return gaussian_kde(centres, weights=histogram[weight].to_numpy())(np.asarray(x))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a SQL query over the trips view of the trip Parquet data")
+    parser.add_argument("sql", nargs="?", default="SELECT COUNT(*) AS trips, MIN(date), MAX(date) FROM trips")
+    parser.add_argument("--trips", type=Path, default=trips_path, help="trip Parquet file or partitioned dataset folder")
+    parser.add_argument("--start", help="first date included, e.g. 2022-06-01")
+    parser.add_argument("--end", help="last date included")
+    parser.add_argument("--memory-limit", help="DuckDB memory limit, e.g. 4GB")
+    args = parser.parse_args()
+
+    print(TripStore(args.trips, args.start, args.end, args.memory_limit).query(args.sql).to_string(index=False))
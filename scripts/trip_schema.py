@@ -0,0 +1,143 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Compact trip schema shared by ingestion, the notebooks and the dashboard.
+# - station names/ids and the two enums are dictionary encoded (categoricals in pandas),
+#   so each row only stores a small integer code
+# - coordinates are float32 (~1 m precision at NYC's latitude, plenty for station locations)
+# - timestamps are int32 seconds since 1970-01-01 (use to_datetime() to get datetimes back)
+
+STATION_COLUMNS = ['start_station_name', 'start_station_id', 'end_station_name', 'end_station_id']
+ENUM_COLUMNS = ['rideable_type', 'member_casual']
+COORD_COLUMNS = ['start_lat', 'start_lng', 'end_lat', 'end_lng']
+TIME_COLUMNS = ['started_at', 'ended_at']
+
+TRIP_SCHEMA = pa.schema(
+    [('ride_id', pa.string()),
+     ('rideable_type', pa.dictionary(pa.int8(), pa.string())),
+     ('started_at', pa.int32()),
+     ('ended_at', pa.int32())]
+    + [(col, pa.dictionary(pa.int32(), pa.string())) for col in STATION_COLUMNS]
+    + [(col, pa.float32()) for col in COORD_COLUMNS]
+    + [('member_casual', pa.dictionary(pa.int8(), pa.string())),
+       ('date', pa.date32()),
+       ('trip_duration', pa.float32())]
+)
+
+# Types used when parsing the raw CSVs, before converting to TRIP_SCHEMA
+# (timestamps can have milliseconds in the source files, so they're parsed at ms and truncated afterwards)
+CSV_COLUMN_TYPES = {
+    'ride_id': pa.string(),
+    'rideable_type': pa.dictionary(pa.int32(), pa.string()),
+    'started_at': pa.timestamp('ms'),
+    'ended_at': pa.timestamp('ms'),
+    **{col: pa.dictionary(pa.int32(), pa.string()) for col in STATION_COLUMNS},
+    **{col: pa.float32() for col in COORD_COLUMNS},
+    'member_casual': pa.dictionary(pa.int32(), pa.string()),
+}
+
+# The trip files before February 2021 (and Jersey City's until then) have another layout: no ride_id or
+# rideable_type, spaced column names, usertype Subscriber/Customer and timestamps with 4 decimals (parsed at us).
+# LEGACY_COLUMNS maps them onto the current names
+LEGACY_COLUMNS = {
+    'starttime': 'started_at',
+    'stoptime': 'ended_at',
+    'start station id': 'start_station_id',
+    'start station name': 'start_station_name',
+    'start station latitude': 'start_lat',
+    'start station longitude': 'start_lng',
+    'end station id': 'end_station_id',
+    'end station name': 'end_station_name',
+    'end station latitude': 'end_lat',
+    'end station longitude': 'end_lng',
+    'usertype': 'member_casual',
+}
+LEGACY_CSV_COLUMN_TYPES = {
+    'bikeid': pa.string(),
+    **{legacy: CSV_COLUMN_TYPES[col] for legacy, col in LEGACY_COLUMNS.items()},
+    'starttime': pa.timestamp('us'),
+    'stoptime': pa.timestamp('us'),
+}
+LEGACY_USER_TYPES = {'Subscriber': 'member', 'Customer': 'casual'}
+LEGACY_RIDEABLE_TYPE = 'classic_bike'  # the old files have no bike type
+
+# pandas equivalents of TRIP_SCHEMA
+PANDAS_DTYPES = {
+    'rideable_type': 'category',
+    'member_casual': 'category',
+    **{col: 'category' for col in STATION_COLUMNS},
+    **{col: 'float32' for col in COORD_COLUMNS},
+    **{col: 'int32' for col in TIME_COLUMNS},
+    'trip_duration': 'float32',
+}
+
+
+def _epoch_seconds(arr):
+    return pc.cast(pc.divide(pc.cast(arr, pa.int64()), 1000), pa.int32())
+
+
+def to_trip_schema(batch):
+    # Converts a batch parsed with CSV_COLUMN_TYPES into TRIP_SCHEMA, adding date and trip_duration
+    started = batch.column('started_at')
+    started_s = _epoch_seconds(started)
+    ended_s = _epoch_seconds(batch.column('ended_at'))
+    columns = {
+        'ride_id': batch.column('ride_id'),
+        'started_at': started_s,
+        'ended_at': ended_s,
+        'date': pc.cast(started, pa.date32()),
+        'trip_duration': pc.cast(pc.divide(pc.cast(pc.subtract(ended_s, started_s), pa.float32()), 60), pa.float32()),
+    }
+    for col in STATION_COLUMNS + ENUM_COLUMNS + COORD_COLUMNS:
+        columns[col] = batch.column(col)
+    return pa.RecordBatch.from_arrays(
+        [pc.cast(columns[field.name], field.type) for field in TRIP_SCHEMA],
+        schema=TRIP_SCHEMA,
+    )
+
+
+def is_legacy_header(header):
+    # True for the header line of a trip CSV in the pre-2021 layout
+    return 'starttime' in header.replace('"', '').split(',')
+
+
+def legacy_to_trip_schema(batch):
+    # Converts a batch parsed with LEGACY_CSV_COLUMN_TYPES into TRIP_SCHEMA. ride_id is made up from the bike id
+    # and the start second (a bike starts one trip at a time), so the sample hashes stay deterministic
+    columns = {col: batch.column(legacy) for legacy, col in LEGACY_COLUMNS.items()}
+    for col in TIME_COLUMNS:
+        columns[col] = pc.cast(columns[col], pa.timestamp('ms'), safe=False)
+    # Subscriber -> member, Customer -> casual, anything else missing
+    user_type = pc.cast(columns['member_casual'], pa.string())
+    position = pc.index_in(user_type, pa.array(list(LEGACY_USER_TYPES)))
+    columns['member_casual'] = pa.array(list(LEGACY_USER_TYPES.values())).take(position)
+    columns['ride_id'] = pc.binary_join_element_wise(
+        batch.column('bikeid'), pc.cast(_epoch_seconds(columns['started_at']), pa.string()), '-'
+    )
+    columns['rideable_type'] = pa.array([LEGACY_RIDEABLE_TYPE] * batch.num_rows, pa.string())
+    return to_trip_schema(pa.RecordBatch.from_pydict(columns))
+
+
+def apply_trip_dtypes(df):
+    # Converts whatever columns of the trip schema are in df to their compact dtypes (in place, returns df).
+    # Handles frames loaded from older files too, e.g. datetime64 timestamps or string station columns
+    for col in TIME_COLUMNS:
+        if col in df and pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = (df[col].astype('datetime64[s]').astype('int64')).astype('int32')
+        elif col in df and df[col].dtype == object:
+            df[col] = (pd.to_datetime(df[col]).astype('datetime64[s]').astype('int64')).astype('int32')
+    for col, dtype in PANDAS_DTYPES.items():
+        if col in df and df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def read_trips(path, columns=None, **kwargs):
+    # pd.read_parquet for trip data, making sure the result follows the compact schema
+    return apply_trip_dtypes(pd.read_parquet(path, columns=columns, **kwargs))
+
+
+def to_datetime(seconds):
+    # Epoch-second column -> datetime64 series
+    return pd.to_datetime(pd.Series(seconds).astype('int64'), unit='s')
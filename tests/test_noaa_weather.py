@@ -0,0 +1,128 @@
+import json
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "scripts"))  # shared helpers live in scripts/
+import noaa_weather
+from noaa_weather import WeatherClient, to_wide
+
+# WeatherClient against a local stand-in for the NOAA API: paged JSON like the real /data endpoint, with
+# errors to answer before the real pages and a log of every request.
+
+
+class StubAPI:
+    def __init__(self, days=25, datatypes=('TAVG', 'PRCP', 'AWND')):
+        # one record per day and datatype from 2022-01-01
+        self.records = [
+            {'date': f"{date(2022, 1, 1) + timedelta(days=day)}T00:00:00", 'datatype': datatype, 'value': day}
+            for day in range(days) for datatype in datatypes
+        ]
+        self.failures = {}  # offset -> status codes answered, in order, before the page itself
+        self.requests = []  # (time, offset, status)
+        self.lock = threading.Lock()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                offset, limit = int(query['offset'][0]), int(query['limit'][0])
+                with api.lock:
+                    pending = api.failures.get(offset, [])
+                    status = pending.pop(0) if pending else 200
+                    api.requests.append((time.monotonic(), offset, status))
+                if status != 200:
+                    self.send_response(status)
+                    self.end_headers()
+                    return
+                page = api.records[offset - 1:offset - 1 + limit]
+                body = {'metadata': {'resultset': {'offset': offset, 'count': len(api.records), 'limit': limit}},
+                        'results': page} if page else {}
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/data"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def ok_offsets(self):
+        return sorted(offset for _, offset, status in self.requests if status == 200)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(noaa_weather, 'PAGE_LIMIT', 10)  # 75 records -> 8 pages
+    stub = StubAPI()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+def client(api, cache_dir, **kwargs):
+    return WeatherClient('token', cache_dir, api_url=api.url, **kwargs)
+
+
+def test_pages_are_fetched_and_joined_in_order(api, tmp_path):
+    weather = client(api, tmp_path)
+    records = weather.fetch('2022-01-01', '2022-12-31')
+    assert records == api.records
+    assert api.ok_offsets() == list(range(1, 76, 10))
+    assert weather.requested == 8
+    wide = to_wide(records)
+    assert len(wide) == 25 and list(wide.columns) == ['date', 'AWND', 'PRCP', 'TAVG']
+
+
+def test_requests_are_spaced_by_the_rate_limit(api, tmp_path):
+    client(api, tmp_path, workers=4, requests_per_second=20).fetch('2022-01-01', '2022-12-31')
+    times = sorted(t for t, _, _ in api.requests)
+    # 8 requests at most 20 per second, even with 4 threads: at least 7 intervals of 50 ms (some slack for timing)
+    assert times[-1] - times[0] >= 7 * 0.05 * 0.8
+
+
+def test_rate_limited_and_server_errors_are_retried(api, tmp_path):
+    api.failures = {11: [429], 21: [503, 500]}
+    weather = client(api, tmp_path, workers=2)
+    assert weather.fetch('2022-01-01', '2022-12-31') == api.records
+    assert [status for _, offset, status in api.requests if offset == 21] == [503, 500, 200]
+    assert weather.requested == 8
+
+
+def test_client_errors_are_not_retried(api, tmp_path):
+    api.failures = {1: [400]}
+    with pytest.raises(requests.HTTPError):
+        client(api, tmp_path).fetch('2022-01-01', '2022-12-31')
+    assert len(api.requests) == 1
+
+
+def test_second_run_is_served_from_the_cache(api, tmp_path):
+    first = client(api, tmp_path)
+    records = first.fetch('2022-01-01', '2022-12-31')
+    second = client(api, tmp_path)
+    assert second.fetch('2022-01-01', '2022-12-31') == records
+    assert second.requested == 0
+    assert len(api.requests) == 8
+
+
+def test_unsettled_ranges_are_requested_again(api, tmp_path):
+    # a range ending today isn't final yet, so it's neither cached nor read from the cache
+    today = date.today()
+    start = date(today.year, 1, 1).isoformat()
+    client(api, tmp_path).fetch(start, today.isoformat())
+    assert not list(tmp_path.glob("*.json"))
+    again = client(api, tmp_path)
+    again.fetch(start, today.isoformat())
+    assert again.requested == 8